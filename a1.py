@@ -2,18 +2,263 @@
 # Implement the specified commands to complete the assignment
 # Full assignment specification here: https://webdocs.cs.ualberta.ca/~mmueller/courses/cmput455/assignments/a1.html
 
+import os
 import sys
+import io
+import codecs
+import select
+import marshal
+import mmap
+import tempfile
+import math
+import time
 import random
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from itertools import compress, product
+from struct import Struct
+
+# NumPy is optional and slow to import, load_numpy() imports it on first use
+np = None
+
+class TimingStat:
+    '''
+    Call count and latency histogram of one command or function. Bucket i of the
+    histogram counts timed calls that took less than 2**i microseconds (the last
+    bucket takes everything slower).
+    '''
+    __slots__ = ("calls", "timed", "total", "histogram")
+
+    BUCKETS = 32
+
+    def __init__(self):
+
+        self.calls = 0
+        self.timed = 0
+        self.total = 0.0
+        self.histogram = [0] * self.BUCKETS
+
+    def add(self, seconds):
+        self.timed += 1
+        self.total += seconds
+        self.histogram[min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        # Upper bound in microseconds of the bucket holding the p-th percentile
+        rank = max(1, -(-p * self.timed // 100))
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return 2 ** bucket
+        return 0
+
+# Per command and per hot function statistics, shown by the 'stats' command
+STATS = {}
+
+# Only one in this many calls of a hot function is timed (starting with the first); all of them are counted
+SAMPLE_INTERVAL = 16
+
+# Random legal_flags entries sample_legal_move tries before listing the legal moves
+SAMPLE_PROBES = 16
+
+def instrumented(name):
+    # Decorator counting the calls of a hot function and timing a sample of them
+    def decorate(function):
+        stat = STATS.setdefault(name, TimingStat())
+        def wrapper(*args):
+            stat.calls += 1
+            if stat.calls % SAMPLE_INTERVAL != 1:
+                return function(*args)
+            start = time.perf_counter()
+            result = function(*args)
+            stat.add(time.perf_counter() - start)
+            return result
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+# All (x, y, digit) moves of a board in row-major order, shared by games of the same size
+_move_lists = {}
+
+def move_list(width, height):
+    if (width, height) not in _move_lists:
+        _move_lists[(width, height)] = [(x, y, digit) for y in range(height) for x in range(width) for digit in (0, 1)]
+    return _move_lists[(width, height)]
+
+# Zobrist keys, one random 64-bit number per (x, y, digit) in legal_flags order.
+# Seeded by the board size so every process computes the same keys.
+_zobrist_tables = {}
+
+def zobrist_keys(width, height):
+    if (width, height) not in _zobrist_tables:
+        rng = random.Random(width * 1000003 + height)
+        _zobrist_tables[(width, height)] = [rng.getrandbits(64) for _ in range(2 * width * height)]
+    return _zobrist_tables[(width, height)]
+
+def symmetry_maps(width, height):
+    '''
+    Cell permutations under which the rules are invariant: identity, horizontal
+    flip, vertical flip and 180 degree rotation, plus on square boards the
+    transpose, anti-transpose and the two 90 degree rotations
+
+    :return: one list per symmetry mapping the cell index y * width + x to the index of its image
+    :rtype: List[List[int]]
+    '''
+    transforms = [
+        lambda x, y: (x, y),
+        lambda x, y: (width - 1 - x, y),
+        lambda x, y: (x, height - 1 - y),
+        lambda x, y: (width - 1 - x, height - 1 - y)
+    ]
+    if width == height:
+        transforms += [
+            lambda x, y: (y, x),
+            lambda x, y: (width - 1 - y, height - 1 - x),
+            lambda x, y: (width - 1 - y, x),
+            lambda x, y: (y, height - 1 - x)
+        ]
+    maps = []
+    for transform in transforms:
+        cells = []
+        for y in range(height):
+            for x in range(width):
+                tx, ty = transform(x, y)
+                cells.append(ty * width + tx)
+        maps.append(cells)
+    return maps
+
+# For every move index, the Zobrist key of its image under each symmetry, with and
+# without swapping 0 and 1, packed into one integer of 64-bit lanes (identity in the
+# lowest lane). Xoring these into one integer keeps the hash of every symmetric
+# variant of the board with a single xor per move, and the smallest lane is a
+# canonical key.
+_symmetric_zobrist_tables = {}
+
+def symmetric_zobrist_keys(width, height):
+    if (width, height) not in _symmetric_zobrist_tables:
+        keys = zobrist_keys(width, height)
+        maps = symmetry_maps(width, height)
+        table = []
+        for cell in range(width * height):
+            for digit in (0, 1):
+                lanes = [keys[cells[cell] * 2 + (digit ^ swap)] for cells in maps for swap in (0, 1)]
+                table.append(sum(lane << (64 * i) for i, lane in enumerate(lanes)))
+        _symmetric_zobrist_tables[(width, height)] = table
+    return _symmetric_zobrist_tables[(width, height)]
+
+# Rows and columns up to this length get a precomputed pattern table
+LINE_TABLE_MAX_LENGTH = 10
+# Part of the cache file names, changed whenever the table contents change
+LINE_TABLE_FORMAT = 2
+# Where line tables are saved so that later processes load them instead of rebuilding
+CACHE_DIR = os.environ.get("A1_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".a1cache"))
+# Mode of the files written through tempfile.mkstemp, which makes them readable by their owner
+# only: readable by everyone, less the umask, as open() would have created them. The umask can
+# only be read by setting it, so that is done once at import, before any thread is started.
+_umask = os.umask(0o022)
+os.umask(_umask)
+SHARED_FILE_MODE = 0o644 & ~_umask
+
+def build_line_table(length):
+    '''
+    Enumerates every content of one row or column of the given length that obeys
+    the rules (no three in a row, at most (length + 1) // 2 of each digit)
+
+    :return: dictionary from line state zeros | ones << length (bit masks) to a bit mask with bit 2 * position + digit set for every legal placement
+    :rtype: Dict[int, int]
+    '''
+    limit = (length + 1) // 2
+    states = []
+    def extend(position, zeros, ones, zero_count, one_count):
+        if position == length:
+            states.append((zeros, ones, zero_count, one_count))
+            return
+        extend(position + 1, zeros, ones, zero_count, one_count)
+        bit = 1 << position
+        if zero_count < limit:
+            mask = zeros | bit
+            if not mask & (mask >> 1) & (mask >> 2):
+                extend(position + 1, mask, ones, zero_count + 1, one_count)
+        if one_count < limit:
+            mask = ones | bit
+            if not mask & (mask >> 1) & (mask >> 2):
+                extend(position + 1, zeros, mask, zero_count, one_count + 1)
+    extend(0, 0, 0, 0, 0)
+
+    table = {}
+    for zeros, ones, zero_count, one_count in states:
+        legal = 0
+        for position in range(length):
+            bit = 1 << position
+            if (zeros | ones) & bit:
+                continue
+            for digit, mask, count in ((0, zeros, zero_count), (1, ones, one_count)):
+                mask |= bit
+                if count < limit and not mask & (mask >> 1) & (mask >> 2):
+                    legal |= 1 << (2 * position + digit)
+        table[zeros | (ones << length)] = legal
+    return table
+
+_line_tables = {}
+
+def line_table(length):
+    # The table of build_line_table, memoized and cached on disk; None if length is too large
+    if length > LINE_TABLE_MAX_LENGTH:
+        return None
+    if length not in _line_tables:
+        path = os.path.join(CACHE_DIR, f"line-{length}-v{LINE_TABLE_FORMAT}.marshal")
+        table = None
+        try:
+            with open(path, "rb") as cache_file:
+                table = marshal.load(cache_file)
+        except Exception:
+            table = None
+        if not isinstance(table, dict):
+            table = build_line_table(length)
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                # Write to a temporary file first so readers never see half a table
+                descriptor, temporary = tempfile.mkstemp(dir=CACHE_DIR)
+                with os.fdopen(descriptor, "wb") as cache_file:
+                    marshal.dump(table, cache_file)
+                os.chmod(temporary, SHARED_FILE_MODE)
+                os.replace(temporary, path)
+            except OSError:
+                pass
+        _line_tables[length] = table
+    return _line_tables[length]
 
 class BinaryGame:
 
+    # Name used for this representation by the 'game' command
+    board_type = "list"
+    # Whether get_legal_moves picks from a shared list of every move of the board size
+    keep_move_list = True
+
     def __init__(self, width, height):
 
         self.width = width
         self.height = height
         self.board = [['.'] * width for _ in range(height)]
         self.last_player = None
+        # Live legal-move set: legal_flags[(y * width + x) * 2 + digit] is 1 while
+        # (x, y, digit) is legal. Every placement on an empty board is legal, and the
+        # rules only ever tighten, so moves are removed but never added back.
+        self.all_moves = move_list(width, height) if self.keep_move_list else None
+        self.legal_flags = bytearray(b'\x01') * (2 * width * height)
+        self.legal_count = 2 * width * height
+        # One (x, y, digit, last_player, removed legal moves) entry per move played
+        self.move_stack = []
+        # Zobrist hashes of the board under every symmetry, packed as in
+        # symmetric_zobrist_keys, only maintained after enable_hashing()
+        self.zobrist = None
+        self.hashes = 0
+        self.hash_lanes = None
 
+    @instrumented("is_valid_move")
     def is_valid_move(self, x, y, digit):
         '''
         Checks if the move is valid or not
@@ -39,6 +284,10 @@ class BinaryGame:
             return (False, "wrong number")
         digit = int(digit)
 
+        # Anything still in the legal-move set needs no further checks
+        if self.legal_flags[(y * self.width + x) * 2 + digit]:
+            return (True, None)
+
         # Check if the specified cell is occupied
         if self.board[y][x] != '.':
             return (False, "occupied")
@@ -53,6 +302,10 @@ class BinaryGame:
 
         return (True, None)
 
+    def check_move(self, x, y, digit):
+        # Integer version of is_valid_move for coordinates known to be on the board
+        return self.board[y][x] == '.' and self.check_triples_constraint(x, y, digit) and self.check_balance_constraint(x, y, digit)
+
     def check_triples_constraint(self, x, y, digit):
         # Check row
         row = ''.join(self.board[y][:x] + [str(digit)] + self.board[y][x+1:])
@@ -81,32 +334,127 @@ class BinaryGame:
             return False
         return True
 
+    @instrumented("make_move")
     def make_move(self, x, y, digit):
 
         valid_move, reason = self.is_valid_move(x, y, digit)
         if valid_move:
-            self.board[int(y)][int(x)] = str(digit)
-            if self.last_player == None:
-                self.last_player = 1
-            else:
-                self.last_player = 3 - self.last_player
+            self.play_move(int(x), int(y), int(digit))
             return (True, None)
             
         return (False, reason)
 
+    def play_move(self, x, y, digit):
+        # Play a move already known to be legal, given as integers
+        self.place(x, y, digit)
+        if self.zobrist is not None:
+            self.hashes ^= self.zobrist[(y * self.width + x) * 2 + digit]
+        removed = self.update_legal_moves(x, y)
+        self.move_stack.append((x, y, digit, self.last_player, removed))
+        if self.last_player == None:
+            self.last_player = 1
+        else:
+            self.last_player = 3 - self.last_player
+
+    def undo_move(self):
+        '''
+        Takes back the last move, restoring the board, the player to move and the
+        legal-move set
+
+        :return: the tuple with the first item is whether a move was undone and the second item is the reason if not
+        :rtype: Tuple[bool, str]
+        '''
+        if not self.move_stack:
+            return (False, "no moves to undo")
+        x, y, digit, self.last_player, removed = self.move_stack.pop()
+        self.remove(x, y, digit)
+        if self.zobrist is not None:
+            self.hashes ^= self.zobrist[(y * self.width + x) * 2 + digit]
+        flags = self.legal_flags
+        for index in removed:
+            flags[index] = 1
+        self.legal_count += len(removed)
+        return (True, None)
+
+    def enable_hashing(self):
+        # Start maintaining self.hashes; costs one xor per move from now on
+        if self.zobrist is None:
+            self.zobrist = symmetric_zobrist_keys(self.width, self.height)
+            self.hash_lanes = Struct(f"<{2 * len(symmetry_maps(self.width, self.height))}Q")
+            self.hashes = 0
+            for x, y, digit, _, _ in self.move_stack:
+                self.hashes ^= self.zobrist[(y * self.width + x) * 2 + digit]
+
+    def canonical_hash(self):
+        # Same value for all boards that are symmetric to each other or differ by swapping 0 and 1
+        lanes = self.hash_lanes
+        return min(lanes.unpack(self.hashes.to_bytes(lanes.size, "little")))
+
+    def place(self, x, y, digit):
+        # Write an already validated move onto the board
+        self.board[y][x] = str(digit)
+
+    def remove(self, x, y, digit):
+        # Inverse of place
+        self.board[y][x] = '.'
+
+    def update_legal_moves(self, x, y):
+        # A move at (x, y) can only make moves in row y and column x illegal.
+        # Returns the indices that were removed so undo_move can put them back.
+        flags = self.legal_flags
+        removed = []
+        base = y * self.width * 2
+        for i in range(self.width):
+            for digit in (0, 1):
+                index = base + i * 2 + digit
+                if flags[index] and not self.check_move(i, y, digit):
+                    flags[index] = 0
+                    removed.append(index)
+        for j in range(self.height):
+            for digit in (0, 1):
+                index = (j * self.width + x) * 2 + digit
+                if flags[index] and not self.check_move(x, j, digit):
+                    flags[index] = 0
+                    removed.append(index)
+        self.legal_count -= len(removed)
+        return removed
+
+    @instrumented("get_legal_moves")
     def get_legal_moves(self):
-        moves = []
-        for y in range(self.height):
-            for x in range(self.width):
-                for digit in ['0', '1']:
-                    if self.is_valid_move(str(x), str(y), digit)[0]:
-                        moves.append((x, y, int(digit)))
+        # Row-major order, 0 before 1, same as a full scan of the board
+        return list(self.legal_moves())
 
-        return moves
+    def legal_moves(self):
+        # Lazy version of get_legal_moves
+        return compress(self.all_moves, self.legal_flags)
+
+    def sample_legal_move(self, rng=random):
+        '''
+        Picks a uniformly random legal move by probing random entries of legal_flags,
+        listing the legal moves only if none of the probes hits one. Both ways are
+        uniform, so the result is too.
+
+        :param rng: source of random numbers, the random module by default
+        :type rng: random.Random
+        :return: the move (x, y, digit), or None if there is no legal move
+        :rtype: Tuple[int, int, int]
+        '''
+        if self.legal_count == 0:
+            return None
+        flags = self.legal_flags
+        size = len(flags)
+        # Probing pays off while at least one entry in SAMPLE_PROBES is legal
+        if self.legal_count * SAMPLE_PROBES >= size:
+            for _ in range(SAMPLE_PROBES):
+                index = rng.randrange(size)
+                if flags[index]:
+                    cell = index >> 1
+                    return (cell % self.width, cell // self.width, index & 1)
+        return rng.choice(list(self.legal_moves()))
 
     def is_game_over(self):
 
-        return len(self.get_legal_moves()) == 0
+        return self.legal_count == 0
 
     def get_winner(self):
 
@@ -114,13 +462,1012 @@ class BinaryGame:
             return self.last_player
         return None
 
+class BitboardBinaryGame(BinaryGame):
+    '''
+    BinaryGame that also keeps, for each digit, one integer bit mask per row and
+    per column plus the number of set bits in each of them. The triple and balance
+    checks become a few integer operations instead of rebuilding the row and column
+    as strings. self.board is still kept up to date so show and friends are unchanged.
+    '''
+
+    board_type = "bitboard"
+
+    def __init__(self, width, height):
+
+        super().__init__(width, height)
+        # row_masks[digit][y] has bit x set when board[y][x] == str(digit)
+        self.row_masks = ([0] * height, [0] * height)
+        self.col_masks = ([0] * width, [0] * width)
+        # Popcounts of the masks above
+        self.row_counts = ([0] * height, [0] * height)
+        self.col_counts = ([0] * width, [0] * width)
+        self.row_limit = (width + 1) // 2
+        self.col_limit = (height + 1) // 2
+        # Precomputed legal placements for every line state, see build_line_table.
+        # Only used when both lines are short enough to have a table.
+        self.row_table = line_table(width)
+        self.col_table = line_table(height)
+        self.use_tables = self.row_table is not None and self.col_table is not None
+        if self.use_tables:
+            # row_legal[y] is row_table[state of row y], kept up to date by place and remove
+            self.row_legal = [self.row_table[0]] * height
+            self.col_legal = [self.col_table[0]] * width
+
+    def check_move(self, x, y, digit):
+        if self.use_tables:
+            return (self.row_legal[y] >> (2 * x + digit)) & (self.col_legal[x] >> (2 * y + digit)) & 1 == 1
+        return super().check_move(x, y, digit)
+
+    def update_legal_moves(self, x, y):
+        if not self.use_tables:
+            return super().update_legal_moves(x, y)
+        # Only the placements the move made illegal in row y and column x need clearing:
+        # the bits set in the line's table entry before the move but not after it
+        flags = self.legal_flags
+        width = self.width
+        digit = int(self.board[y][x])
+        removed = []
+        row_masks = self.row_masks
+        before = self.row_table[(row_masks[0][y] | row_masks[1][y] << width) ^ (1 << (x + digit * width))]
+        newly = before & ~self.row_legal[y]
+        base = y * width * 2
+        while newly:
+            low = newly & -newly
+            newly ^= low
+            index = base + low.bit_length() - 1
+            if flags[index]:
+                flags[index] = 0
+                removed.append(index)
+        col_masks = self.col_masks
+        before = self.col_table[(col_masks[0][x] | col_masks[1][x] << self.height) ^ (1 << (y + digit * self.height))]
+        newly = before & ~self.col_legal[x]
+        while newly:
+            low = newly & -newly
+            newly ^= low
+            bit = low.bit_length() - 1
+            index = ((bit >> 1) * width + x) * 2 + (bit & 1)
+            if flags[index]:
+                flags[index] = 0
+                removed.append(index)
+        self.legal_count -= len(removed)
+        return removed
+
+    def check_triples_constraint(self, x, y, digit):
+        # The board never holds a triple, so only the new bit can create one
+        row = self.row_masks[digit][y] | (1 << x)
+        if row & (row >> 1) & (row >> 2):
+            return False
+        col = self.col_masks[digit][x] | (1 << y)
+        if col & (col >> 1) & (col >> 2):
+            return False
+        return True
+
+    def check_balance_constraint(self, x, y, digit):
+        if self.row_counts[digit][y] >= self.row_limit:
+            return False
+        if self.col_counts[digit][x] >= self.col_limit:
+            return False
+        return True
+
+    def place(self, x, y, digit):
+        super().place(x, y, digit)
+        self.row_masks[digit][y] |= 1 << x
+        self.col_masks[digit][x] |= 1 << y
+        self.row_counts[digit][y] += 1
+        self.col_counts[digit][x] += 1
+        if self.use_tables:
+            self.update_line_states(x, y)
+
+    def remove(self, x, y, digit):
+        super().remove(x, y, digit)
+        self.row_masks[digit][y] &= ~(1 << x)
+        self.col_masks[digit][x] &= ~(1 << y)
+        self.row_counts[digit][y] -= 1
+        self.col_counts[digit][x] -= 1
+        if self.use_tables:
+            self.update_line_states(x, y)
+
+    def update_line_states(self, x, y):
+        # Looks up the new states of row y and column x after a change at (x, y)
+        self.row_legal[y] = self.row_table[self.row_masks[0][y] | (self.row_masks[1][y] << self.width)]
+        self.col_legal[x] = self.col_table[self.col_masks[0][x] | (self.col_masks[1][x] << self.height)]
+
+class LargeBinaryGame(BitboardBinaryGame):
+    '''
+    BitboardBinaryGame for boards far beyond 20x20. After a move, the moves it made
+    illegal are found with a few whole-line mask operations on the changed row and
+    column instead of checking every cell of them, and there is no list of every
+    move of the board size; get_legal_moves builds its list from legal_flags.
+    '''
+
+    board_type = "large"
+    keep_move_list = False
+
+    @staticmethod
+    def line_illegal(mask, empty, count, limit):
+        # Empty cells of a line where the digit of mask would break a rule
+        if count >= limit:
+            return empty
+        return empty & (((mask << 1) & (mask << 2)) | ((mask >> 1) & (mask >> 2)) | ((mask << 1) & (mask >> 1)))
+
+    def update_legal_moves(self, x, y):
+        flags = self.legal_flags
+        width = self.width
+        digit = int(self.board[y][x])
+        # The cell itself is taken for both digits
+        removed = [index for index in ((y * width + x) * 2, (y * width + x) * 2 + 1) if flags[index]]
+        for index in removed:
+            flags[index] = 0
+        # Only the placed digit's rules tighten; compare its illegal cells before and after the move
+        row = self.row_masks[digit][y]
+        row_empty = ~(self.row_masks[0][y] | self.row_masks[1][y]) & ((1 << width) - 1)
+        count = self.row_counts[digit][y]
+        newly = self.line_illegal(row, row_empty, count, self.row_limit) & ~self.line_illegal(row & ~(1 << x), row_empty, count - 1, self.row_limit)
+        base = y * width * 2 + digit
+        while newly:
+            low = newly & -newly
+            newly ^= low
+            index = base + (low.bit_length() - 1) * 2
+            if flags[index]:
+                flags[index] = 0
+                removed.append(index)
+        col = self.col_masks[digit][x]
+        col_empty = ~(self.col_masks[0][x] | self.col_masks[1][x]) & ((1 << self.height) - 1)
+        count = self.col_counts[digit][x]
+        newly = self.line_illegal(col, col_empty, count, self.col_limit) & ~self.line_illegal(col & ~(1 << y), col_empty, count - 1, self.col_limit)
+        base = x * 2 + digit
+        while newly:
+            low = newly & -newly
+            newly ^= low
+            index = base + (low.bit_length() - 1) * width * 2
+            if flags[index]:
+                flags[index] = 0
+                removed.append(index)
+        self.legal_count -= len(removed)
+        return removed
+
+    @instrumented("get_legal_moves")
+    def get_legal_moves(self):
+        # The same moves as legal_moves, a list comprehension is faster than list() of a generator
+        candidates = product(range(self.height), range(self.width), (0, 1))
+        return [(x, y, digit) for y, x, digit in compress(candidates, self.legal_flags)]
+
+    def legal_moves(self):
+        # The candidate moves are generated on the fly instead of kept in a list of every move
+        candidates = product(range(self.height), range(self.width), (0, 1))
+        return ((x, y, digit) for y, x, digit in compress(candidates, self.legal_flags))
+
+def load_numpy():
+    # The numpy module, or None if it is not installed
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+def board_array(game):
+    # The board as an int8 NumPy array with -1 for empty cells
+    return np.array([[-1 if cell == '.' else int(cell) for cell in row] for row in game.board], dtype=np.int8)
+
+def triples_along(same, axis):
+    # For each cell, whether placing the digit there completes three in a row along axis
+    same = np.moveaxis(same, axis, -1)
+    n = same.shape[-1]
+    padded = np.pad(same, [(0, 0)] * (same.ndim - 1) + [(2, 2)])
+    left2, left1 = padded[..., 0:n], padded[..., 1:n + 1]
+    right1, right2 = padded[..., 3:n + 3], padded[..., 4:n + 4]
+    triples = (left2 & left1) | (left1 & right1) | (right1 & right2)
+    return np.moveaxis(triples, -1, axis)
+
+def numpy_legal_masks(cells):
+    '''
+    Computes the legality of every cell for both digits in one batched pass
+
+    :param cells: int8 array of shape (..., height, width) with -1 for empty cells, any leading axes are independent boards
+    :type cells: numpy.ndarray
+    :return: bool array of shape (2, ..., height, width), indexed by digit first
+    :rtype: numpy.ndarray
+    '''
+    height, width = cells.shape[-2:]
+    empty = cells < 0
+    masks = []
+    for digit in (0, 1):
+        same = cells == digit
+        triples = triples_along(same, -1) | triples_along(same, -2)
+        row_ok = same.sum(axis=-1, keepdims=True) < (width + 1) // 2
+        col_ok = same.sum(axis=-2, keepdims=True) < (height + 1) // 2
+        masks.append(empty & ~triples & row_ok & col_ok)
+    return np.stack(masks)
+
+def batched_playouts(game, count, seed=None):
+    '''
+    Plays count independent uniformly random games to the end from the current
+    position at once, as a stack of NumPy boards advanced one move per step
+
+    :param game: the position to start from, left unchanged
+    :type game: BinaryGame
+    :param count: the number of playouts
+    :type count: int
+    :param seed: seed for the NumPy random generator
+    :type seed: int
+    :return: the tuple of the wins of player 1 and player 2, and a dictionary from each first move (x, y, digit) to a [playouts, wins for the player who made it] pair
+    :rtype: Tuple[List[int], Dict[Tuple[int, int, int], List[int]]]
+    '''
+    load_numpy()
+    rng = np.random.default_rng(seed)
+    width, height = game.width, game.height
+    to_move = 1 if game.last_player == None else 3 - game.last_player
+    cells = np.repeat(board_array(game).reshape(1, height * width), count, axis=0)
+    # Playouts still running, how many moves each has made and its first move index
+    alive = np.arange(count)
+    moves_made = np.zeros(count, dtype=np.int32)
+    first_move = np.full(count, -1, dtype=np.int64)
+    while len(alive) > 0:
+        # (boards, cells * 2) in legal_flags order
+        masks = numpy_legal_masks(cells.reshape(-1, height, width))
+        legal = np.stack((masks[0], masks[1]), axis=-1).reshape(len(alive), -1)
+        # Pick the k-th legal move of each board with k uniform below its number of legal moves
+        counts = np.cumsum(legal, axis=1, dtype=np.int32)
+        running = counts[:, -1] > 0
+        if not running.all():
+            alive, cells, counts = alive[running], cells[running], counts[running]
+            if len(alive) == 0:
+                break
+        k = (rng.random(len(alive)) * counts[:, -1]).astype(np.int32)
+        choice = (counts <= k[:, None]).argmin(axis=1)
+        cells[np.arange(len(alive)), choice // 2] = choice % 2
+        first_move[alive[moves_made[alive] == 0]] = choice[moves_made[alive] == 0]
+        moves_made[alive] += 1
+
+    # The player who made the last move wins
+    if game.last_player == None:
+        last_when_none = 1
+    else:
+        last_when_none = game.last_player
+    winners = np.where(moves_made % 2 == 1, to_move, 3 - to_move)
+    winners[moves_made == 0] = last_when_none
+    wins = [int((winners == 1).sum()), int((winners == 2).sum())]
+    first_moves = {}
+    started = first_move >= 0
+    indices, playouts = np.unique(first_move[started], return_counts=True)
+    won = np.bincount(first_move[started & (winners == to_move)], minlength=2 * width * height)
+    for index, played in zip(indices.tolist(), playouts.tolist()):
+        first_moves[((index >> 1) % width, (index >> 1) // width, index & 1)] = [played, int(won[index])]
+    return wins, first_moves
+
+class TranspositionTable:
+    '''
+    Fixed-size table of search results keyed by position hash. The number of slots
+    is derived from the memory cap and never grows. Slots come in pairs per bucket:
+    the first keeps the entry that took the most work (nodes) to compute, the second
+    always takes the newest entry. An entry pushed out of both slots is an eviction.
+    '''
+
+    # Memory per slot at worst: three list pointers plus the key, work and value int
+    # objects, when none of them is one of the shared small ints
+    ENTRY_BYTES = 128
+
+    def __init__(self, size_mb=16):
+
+        buckets = 1
+        while buckets * 4 * self.ENTRY_BYTES <= size_mb * 2**20:
+            buckets *= 2
+        self.size_mb = size_mb
+        self.mask = buckets - 1
+        self.keys = [None] * (2 * buckets)
+        self.values = [None] * (2 * buckets)
+        self.work = [0] * (2 * buckets)
+        self.entries = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def capacity(self):
+        return len(self.keys)
+
+    def lookup(self, key):
+        i = (key & self.mask) * 2
+        keys = self.keys
+        if keys[i] == key:
+            self.hits += 1
+            return self.values[i]
+        if keys[i + 1] == key:
+            self.hits += 1
+            return self.values[i + 1]
+        self.misses += 1
+        return None
+
+    def store(self, key, value, work):
+        i = (key & self.mask) * 2
+        keys = self.keys
+        self.stores += 1
+        if keys[i] == key or keys[i] is None or work >= self.work[i]:
+            if keys[i] is None:
+                self.entries += 1
+            elif keys[i] != key:
+                # Demote the old first-slot entry, dropping whatever was in the second slot
+                if keys[i + 1] is None:
+                    self.entries += 1
+                elif keys[i + 1] != key:
+                    self.evictions += 1
+                keys[i + 1], self.values[i + 1], self.work[i + 1] = keys[i], self.values[i], self.work[i]
+            keys[i], self.values[i], self.work[i] = key, value, work
+        else:
+            if keys[i + 1] is None:
+                self.entries += 1
+            elif keys[i + 1] != key:
+                self.evictions += 1
+            keys[i + 1], self.values[i + 1], self.work[i + 1] = key, value, work
+
+    def clear(self):
+        size = len(self.keys)
+        self.keys = [None] * size
+        self.values = [None] * size
+        self.work = [0] * size
+        self.entries = 0
+        self.reset_counters()
+
+def perft(game, depth):
+    # Number of legal move sequences of exactly depth moves from the current position
+    if depth == 0:
+        return 1
+    moves = game.get_legal_moves()
+    if depth == 1:
+        return len(moves)
+    count = 0
+    for x, y, digit in moves:
+        game.play_move(x, y, digit)
+        count += perft(game, depth - 1)
+        game.undo_move()
+    return count
+
+def search_game(board_type, width, height, moves):
+    # The position reached by playing moves on an empty board, for searching. Results do not
+    # depend on the representation, and moves are much faster on bitboards than on lists.
+    game = GAME_TYPES["bitboard" if board_type == "list" else board_type](width, height)
+    for x, y, digit in moves:
+        game.play_move(x, y, digit)
+    return game
+
+class SearchAborted(Exception):
+    pass
+
+# Kinds of depth-limited results kept in the transposition table, stored as
+# depth << 2 | bound. Depth is at least 1, so these never equal a proven +1 or -1.
+EXACT, LOWER, UPPER = 0, 1, 2
+
+class Solver:
+    '''
+    Negamax search with alpha-beta pruning that proves whether the player to move
+    wins. The player with no legal move loses, so a solved position is worth +1 or
+    -1 for the player to move; a position cut off by the depth limit is worth 0
+    (unknown). The search walks the game in place with play_move and undo_move,
+    and gives up when the time or node limit is reached. A list board is searched
+    on a bitboard copy, which gives the same results with much faster moves.
+    '''
+
+    # Number of nodes between two clock checks
+    CHECK_INTERVAL = 256
+
+    def __init__(self, game, time_limit=None, node_limit=None, tt=None):
+
+        if game.board_type == "list":
+            game = search_game(game.board_type, game.width, game.height, [move[:3] for move in game.move_stack])
+        self.game = game
+        # Moves are tried centre first, which proves wins sooner than row-major order:
+        # every move as (x, y, digit) in that order, and its index in legal_flags
+        self.order = sorted(move_list(game.width, game.height), key=lambda move: abs(2 * move[0] - game.width + 1) + abs(2 * move[1] - game.height + 1))
+        self.order_indices = [(y * game.width + x) * 2 + digit for x, y, digit in self.order]
+        # Every move by its index in legal_flags
+        self.moves = move_list(game.width, game.height)
+        self.tt = tt
+        if tt is not None:
+            game.enable_hashing()
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.deadline = None
+        self.elapsed = 0.0
+        # Deepest completed iteration of iterative_deepening
+        self.depth = 0
+
+    def solve(self):
+        '''
+        Solves the current position of the game
+
+        :return: the tuple with the first item is the winning player (None if the search was aborted) and the second item is a winning move for the player to move, or None if the player to move loses
+        :rtype: Tuple[int, Tuple[int, int, int]]
+        '''
+        game = self.game
+        to_move = 1 if game.last_player == None else 3 - game.last_player
+        self.start()
+        stack_depth = len(game.move_stack)
+        try:
+            # No game can last longer than the number of empty cells
+            value, move, _ = self.root(self.empty_cells())
+        except SearchAborted:
+            self.unwind(stack_depth)
+            return (None, None)
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+        if value > 0:
+            return (to_move, move)
+        return (3 - to_move, None)
+
+    def iterative_deepening(self):
+        '''
+        Searches one ply deeper per iteration until the position is solved or the
+        time runs out. A move is ready before the first iteration starts, and each
+        completed iteration replaces it.
+
+        :return: the tuple with the first item is the move to play (None if there is no legal move) and the second item is its value: 1 proven win, -1 proven loss, 0 unknown
+        :rtype: Tuple[Tuple[int, int, int], int]
+        '''
+        game = self.game
+        self.start()
+        self.depth = 0
+        moves = game.get_legal_moves()
+        if not moves:
+            self.elapsed = time.perf_counter() - self.started
+            return (None, -1)
+        best_move = random.choice(moves)
+        best_value = 0
+        stack_depth = len(game.move_stack)
+        try:
+            for depth in range(1, self.empty_cells() + 1):
+                value, move, unproven = self.root(depth, best_move)
+                self.depth = depth
+                best_value = value
+                if value > 0:
+                    best_move = move
+                    break
+                if value < 0:
+                    break
+                if best_move not in unproven:
+                    best_move = random.choice(unproven)
+        except SearchAborted:
+            self.unwind(stack_depth)
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+        return (best_move, best_value)
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.time_limit is not None:
+            self.deadline = self.started + self.time_limit
+        self.nodes = 0
+
+    def unwind(self, stack_depth):
+        # Take back the moves that were in progress when a limit was hit
+        while len(self.game.move_stack) > stack_depth:
+            self.game.undo_move()
+
+    def empty_cells(self):
+        return self.game.width * self.game.height - len(self.game.move_stack)
+
+    def root(self, depth, first=None):
+        # Returns the value of the position, a winning move if there is one, and the moves not proven to lose
+        game = self.game
+        self.nodes += 1
+        flags = game.legal_flags
+        moves = [move for move, index in zip(self.order, self.order_indices) if flags[index]]
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        unproven = []
+        for move in moves:
+            game.play_move(*move)
+            value = -self.negamax(-1, 1, depth - 1)
+            game.undo_move()
+            if value > 0:
+                return (1, move, [move])
+            if value == 0:
+                unproven.append(move)
+        return (0 if unproven else -1, None, unproven)
+
+    def negamax(self, alpha, beta, depth, key=None):
+        game = self.game
+        self.nodes += 1
+        if self.nodes % self.CHECK_INTERVAL == 0:
+            self.check_limits()
+        if game.legal_count == 0:
+            return -1
+        if depth == 0:
+            return 0
+        tt = self.tt
+        flags = game.legal_flags
+        if tt is None:
+            best = -1
+            # The moves are read from legal_flags as the loop goes, without building a list;
+            # every child is undone before the next move is read, so the flags are as before
+            for x, y, digit in compress(self.order, map(flags.__getitem__, self.order_indices)):
+                game.play_move(x, y, digit)
+                value = -self.negamax(-beta, -alpha, depth - 1)
+                game.undo_move()
+                if value > best:
+                    best = value
+                    if best > alpha:
+                        alpha = best
+                        if alpha >= beta:
+                            break
+            return best
+        # Proven values (+1 or -1) do not depend on the depth and symmetric positions
+        # share a key, so they can always be reused. Unknown results are stored as
+        # depth << 2 | bound and only reused by searches that are no deeper.
+        if key is None:
+            key = game.canonical_hash()
+        entry = tt.lookup(key)
+        if entry is not None:
+            if entry == 1 or entry == -1:
+                return entry
+            stored_depth, bound = entry >> 2, entry & 3
+            if stored_depth >= depth and (bound == EXACT or (bound == LOWER and beta <= 0) or (bound == UPPER and alpha >= 0)):
+                return 0
+        start_nodes = self.nodes
+        alpha_start = alpha
+        best = -1
+        # Children are looked up before they are played: one that is proven lost for the
+        # opponent wins straight away, and one proven won for the opponent is worth -1,
+        # no better than best already is, so neither needs its move played
+        hashes = game.hashes
+        zobrist = game.zobrist
+        lanes = game.hash_lanes
+        moves = self.moves
+        for index in compress(self.order_indices, map(flags.__getitem__, self.order_indices)):
+            child_key = min(lanes.unpack((hashes ^ zobrist[index]).to_bytes(lanes.size, "little")))
+            child = tt.lookup(child_key)
+            if child == -1:
+                best = 1
+                break
+            if child == 1:
+                continue
+            game.play_move(*moves[index])
+            value = -self.negamax(-beta, -alpha, depth - 1, child_key)
+            game.undo_move()
+            if value > best:
+                best = value
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+        if best != 0:
+            tt.store(key, best, self.nodes - start_nodes)
+        elif best <= alpha_start:
+            tt.store(key, depth << 2 | UPPER, self.nodes - start_nodes)
+        elif best >= beta:
+            tt.store(key, depth << 2 | LOWER, self.nodes - start_nodes)
+        else:
+            tt.store(key, depth << 2 | EXACT, self.nodes - start_nodes)
+        return best
+
+    def check_limits(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+# Rollout moves between two clock checks in mcts_search
+ROLLOUT_CHECK_INTERVAL = 16
+
+class MCTSNode:
+    # wins counts the playouts won by the player who made move
+    __slots__ = ("move", "parent", "children", "untried", "visits", "wins")
+
+    def __init__(self, move, parent, untried):
+
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0
+
+def mcts_search(board_type, width, height, moves, time_limit, seed, exploration=1.4):
+    '''
+    Runs UCT from the position reached by playing moves on an empty board until
+    time_limit seconds have passed. Module level so it can run in a worker process.
+
+    :return: a dictionary from each root move (x, y, digit) to its [visits, wins]
+    :rtype: Dict[Tuple[int, int, int], List[int]]
+    '''
+    deadline = time.perf_counter() + time_limit
+    rng = random.Random(seed)
+    game = search_game(board_type, width, height, moves)
+    root_moves = game.get_legal_moves()
+    rng.shuffle(root_moves)
+    root = MCTSNode(None, None, root_moves)
+    # The clock is checked after every playout and every ROLLOUT_CHECK_INTERVAL
+    # rollout moves, since one rollout on a big board can take tens of milliseconds.
+    # At least one root move is always expanded, so the result is never empty.
+    while True:
+        node = root
+        depth = 0
+        # Selection
+        while not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            node = max(node.children, key=lambda child: child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits))
+            game.play_move(*node.move)
+            depth += 1
+        # Expansion
+        if node.untried:
+            move = node.untried.pop()
+            game.play_move(*move)
+            depth += 1
+            untried = game.get_legal_moves()
+            rng.shuffle(untried)
+            child = MCTSNode(move, node, untried)
+            node.children.append(child)
+            node = child
+        # Random playout; the player who makes the last move wins
+        rollout = 0
+        timed_out = False
+        move = game.sample_legal_move(rng)
+        while move is not None:
+            game.play_move(*move)
+            rollout += 1
+            if rollout % ROLLOUT_CHECK_INTERVAL == 0 and time.perf_counter() >= deadline:
+                timed_out = True
+                break
+            move = game.sample_legal_move(rng)
+        for _ in range(depth + rollout):
+            game.undo_move()
+        if timed_out:
+            # The unfinished playout counts for nothing
+            break
+        # Backpropagation, from the point of view of the player who moved into each node
+        won = rollout % 2 == 0
+        while node is not None:
+            node.visits += 1
+            if won:
+                node.wins += 1
+            won = not won
+            node = node.parent
+        if time.perf_counter() >= deadline:
+            break
+    return {child.move: [child.visits, child.wins] for child in root.children}
+
+# Boards with at most this many cells can have an endgame database, built with a1endgame.py
+ENDGAME_MAX_CELLS = 16
+ENDGAME_DIR = os.environ.get("A1_ENDGAME_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "endgame"))
+# File header: magic, format version, width, height
+ENDGAME_MAGIC = b"A1EG"
+ENDGAME_HEADER_BYTES = 8
+# 2-bit entries; 0 means the position is not reachable
+ENDGAME_WIN, ENDGAME_LOSS = 1, 2
+
+def position_index(game):
+    # The board as a base-3 number: cell y * width + x is the digit 0 if empty, 1 for '0' and 2 for '1'
+    index = 0
+    for row in reversed(game.board):
+        for cell in reversed(row):
+            index = index * 3 + (0 if cell == '.' else int(cell) + 1)
+    return index
+
+def endgame_path(width, height):
+    return os.path.join(ENDGAME_DIR, f"{width}x{height}.a1eg")
+
+class EndgameDatabase:
+    '''
+    Read-only view of an endgame file written by a1endgame.py. The file holds the
+    result for the player to move of every reachable position, 2 bits each, in
+    position_index order; it is mapped, not read, so only the pages looked at are
+    loaded.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as database_file:
+            self.data = mmap.mmap(database_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.data[:ENDGAME_HEADER_BYTES]
+        if header[:4] != ENDGAME_MAGIC or header[4] != 1:
+            self.data.close()
+            raise ValueError("'" + path + "' is not an endgame database")
+        self.width, self.height = header[5], header[6]
+        self.powers = [3 ** cell for cell in range(self.width * self.height)]
+
+    def entry(self, index):
+        return (self.data[ENDGAME_HEADER_BYTES + (index >> 2)] >> ((index & 3) * 2)) & 3
+
+    def lookup(self, game):
+        '''
+        Looks up the current position of the game
+
+        :return: the tuple with the first item is 1 if the player to move wins, -1 if they lose and None if the position is not in the database, and the second item is a winning move (None if there is none)
+        :rtype: Tuple[int, Tuple[int, int, int]]
+        '''
+        index = position_index(game)
+        entry = self.entry(index)
+        if entry == 0:
+            return (None, None)
+        if entry == ENDGAME_LOSS:
+            return (-1, None)
+        for x, y, digit in game.get_legal_moves():
+            if self.entry(index + self.powers[y * self.width + x] * (digit + 1)) == ENDGAME_LOSS:
+                return (1, (x, y, digit))
+        raise ValueError("'" + self.path + "' is corrupt: won position without a winning move")
+
+_endgame_databases = {}
+
+def endgame_database(width, height):
+    # The opened database for the board size, or None if there is no file for it
+    if width * height > ENDGAME_MAX_CELLS:
+        return None
+    if (width, height) not in _endgame_databases:
+        path = endgame_path(width, height)
+        if not os.path.exists(path):
+            return None
+        _endgame_databases[(width, height)] = EndgameDatabase(path)
+    return _endgame_databases[(width, height)]
+
+# Transposition table of analyze_moves, one per process and kept between calls
+_analysis_tt = None
+
+def analyze_moves(board_type, width, height, moves, root_moves, time_limit, seed):
+    '''
+    Scores root_moves in the position reached by playing moves on an empty board
+    within time_limit seconds. The first half of the time is shared by the moves
+    to be solved exactly (or looked up in the endgame database); the rest goes to
+    random playouts after each unsolved move in turn. Module level so it can run
+    in a worker process.
+
+    :return: one (move, result, score, nodes, playouts) tuple per root move, where result is 'win' or 'loss' (exact, score 1 or 0), 'mc' (score is the playout win rate of the player making move) or 'unknown' (no time was left, score None)
+    :rtype: List[Tuple[Tuple[int, int, int], str, float, int, int]]
+    '''
+    global _analysis_tt
+    if _analysis_tt is None:
+        _analysis_tt = TranspositionTable()
+    rng = random.Random(seed)
+    game = search_game(board_type, width, height, moves)
+    mover = 1 if game.last_player == None else 3 - game.last_player
+    database = endgame_database(width, height)
+    start = time.perf_counter()
+    deadline = start + time_limit
+    solve_deadline = start + time_limit / 2
+    # Solver nodes per second, measured once a solve has run out of time; after that a
+    # solve that cannot reach its first limit check within its share is skipped
+    abort_rate = None
+    results = {}
+    unsolved = []
+    for number, move in enumerate(root_moves):
+        # Solving time left now is shared evenly by the moves still to try
+        share = max(solve_deadline - time.perf_counter(), 0.0) / (len(root_moves) - number)
+        game.play_move(*move)
+        winner = None
+        nodes = 0
+        if database is not None:
+            value, _ = database.lookup(game)
+            if value is not None:
+                winner = 3 - mover if value > 0 else mover
+        if winner is None and share > 0 and (abort_rate is None or abort_rate * share >= Solver.CHECK_INTERVAL):
+            solver = Solver(game, share, None, _analysis_tt)
+            winner, _ = solver.solve()
+            nodes = solver.nodes
+            if winner is None:
+                abort_rate = solver.nodes_per_second()
+        game.undo_move()
+        if winner is None:
+            unsolved.append(move)
+            # [nodes, playouts, wins]
+            results[move] = [nodes, 0, 0]
+        else:
+            results[move] = (move, "win" if winner == mover else "loss", 1.0 if winner == mover else 0.0, nodes, 0)
+
+    # Random playouts, one per unsolved move in turn; the mover wins when a playout has an even number of moves
+    while unsolved and time.perf_counter() < deadline:
+        for move in unsolved:
+            game.play_move(*move)
+            rollout = 0
+            next_move = game.sample_legal_move(rng)
+            while next_move is not None:
+                game.play_move(*next_move)
+                rollout += 1
+                next_move = game.sample_legal_move(rng)
+            for _ in range(rollout + 1):
+                game.undo_move()
+            counts = results[move]
+            counts[0] += rollout
+            counts[1] += 1
+            counts[2] += rollout % 2 == 0
+            if time.perf_counter() >= deadline:
+                break
+    for move in unsolved:
+        nodes, playouts, wins = results[move]
+        if playouts == 0:
+            results[move] = (move, "unknown", None, nodes, 0)
+        else:
+            results[move] = (move, "mc", wins / playouts, nodes, playouts)
+    return [results[move] for move in root_moves]
+
+# Board representations selectable with the optional third argument of 'game'
+GAME_TYPES = {
+    "list" : BinaryGame,
+    "bitboard" : BitboardBinaryGame,
+    "large" : LargeBinaryGame
+}
+
+# Memory cap of the transposition table shared by the searches, in megabytes
+DEFAULT_TT_MB = 64
+# Largest width and height 'game' accepts, and the limit with --large-boards
+MAX_BOARD_SIZE = 20
+LARGE_MAX_BOARD_SIZE = 1000
+
+class PackedGame:
+    '''
+    Compact form of a game that is not being played right now: board type, size
+    and the moves played, one array item per move holding its legal_flags index
+    (y * width + x) * 2 + digit. The board, player to move and undo stack are
+    rebuilt from the moves when the game is unpacked.
+    '''
+    __slots__ = ("board_type", "width", "height", "moves")
+
+    def __init__(self, game):
+
+        self.board_type = game.board_type
+        self.width = game.width
+        self.height = game.height
+        self.moves = array("H" if 2 * game.width * game.height <= 65536 else "I", [(y * game.width + x) * 2 + digit for x, y, digit, _, _ in game.move_stack])
+
+    @classmethod
+    def from_moves(cls, board_type, width, height, moves):
+        packed = cls.__new__(cls)
+        packed.board_type = board_type
+        packed.width = width
+        packed.height = height
+        packed.moves = moves
+        return packed
+
+    def unpack(self):
+        game = GAME_TYPES[self.board_type](self.width, self.height)
+        for index in self.moves:
+            cell = index >> 1
+            game.play_move(cell % self.width, cell // self.width, index & 1)
+        return game
+
+    def replay(self, max_size=MAX_BOARD_SIZE):
+        # Like unpack, but checks the size (as the 'game' command does, before anything is
+        # allocated for the board) and every move through make_move, for games read from a file
+        if not 1 <= self.width <= max_size or not 1 <= self.height <= max_size:
+            raise ValueError(f"Record is {self.width}x{self.height}, width and height must be between 1 and {max_size}")
+        game = GAME_TYPES[self.board_type](self.width, self.height)
+        for number, index in enumerate(self.moves):
+            cell = index >> 1
+            x, y, digit = str(cell % self.width), str(cell // self.width), str(index & 1)
+            valid_move, reason = game.make_move(x, y, digit)
+            if not valid_move:
+                raise ValueError(f"Illegal move {number + 1} in record: {x} {y} {digit} " + reason)
+        return game
+
+# Game record files start with RECORD_MAGIC, followed by one record per game: width,
+# height and number of moves as little-endian 16, 16 and 32 bit integers, then the
+# moves as in PackedGame.moves, little-endian too
+RECORD_MAGIC = b"A1GR\x01"
+RECORD_HEADER_BYTES = 8
+
+def write_record(record_file, packed):
+    # Appends one game to a record file opened for binary appending, starting the file if it is empty
+    if record_file.tell() == 0:
+        record_file.write(RECORD_MAGIC)
+    moves = packed.moves
+    if sys.byteorder != "little":
+        moves = array(moves.typecode, moves)
+        moves.byteswap()
+    header = packed.width.to_bytes(2, "little") + packed.height.to_bytes(2, "little") + len(moves).to_bytes(4, "little")
+    record_file.write(header + moves.tobytes())
+
+def read_records(record_file, board_type="list"):
+    '''
+    Reads the games of a record file one at a time, so files of any length can be
+    streamed
+
+    :param record_file: file opened for binary reading
+    :type record_file: BinaryIO
+    :param board_type: board type the games unpack to
+    :type board_type: str
+    :return: generator of the packed games in file order
+    :rtype: Iterator[PackedGame]
+    '''
+    if record_file.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+        raise ValueError("Not a game record file")
+    while True:
+        header = record_file.read(RECORD_HEADER_BYTES)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER_BYTES:
+            raise ValueError("Game record file is truncated")
+        width = int.from_bytes(header[0:2], "little")
+        height = int.from_bytes(header[2:4], "little")
+        count = int.from_bytes(header[4:8], "little")
+        moves = array("H" if 2 * width * height <= 65536 else "I")
+        data = record_file.read(count * moves.itemsize)
+        if len(data) < count * moves.itemsize:
+            raise ValueError("Game record file is truncated")
+        moves.frombytes(data)
+        if sys.byteorder != "little":
+            moves.byteswap()
+        yield PackedGame.from_moves(board_type, width, height, moves)
+
+class SessionPool:
+    '''
+    Games of the sessions that are not active, packed and keyed by session id, in
+    least recently used order. Sessions idle for longer than idle_seconds, and the
+    least recently used ones beyond max_sessions, are dropped.
+    '''
+
+    def __init__(self, max_sessions=100000, idle_seconds=None):
+
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        # id -> [PackedGame or None, time of last use]
+        self.sessions = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def put(self, session_id, game):
+        self.sessions[session_id] = [None if game is None else PackedGame(game), time.monotonic()]
+        self.sessions.move_to_end(session_id)
+        self.evict()
+
+    def take(self, session_id):
+        # Removes the session from the pool and returns its unpacked game (None if it has none)
+        packed, _ = self.sessions.pop(session_id)
+        return None if packed is None else packed.unpack()
+
+    def drop(self, session_id):
+        del self.sessions[session_id]
+
+    def evict(self):
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+        if self.idle_seconds is not None:
+            oldest = time.monotonic() - self.idle_seconds
+            while self.sessions and next(iter(self.sessions.values()))[1] < oldest:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+
+# Default 'timelimit': seconds genmove and solve may think, under a1test.py's 1 second timeout
+DEFAULT_MOVE_TIME = 0.8
+# Time kept back from the MCTS workers for starting them and merging their results
+MCTS_OVERHEAD = 0.15
+# Move selection strategies for genmove
+STRATEGIES = ["random", "sample", "mcts", "search"]
+
 class CommandInterface:
     # The following is already defined and does not need modification
     # However, you may change or add to this code as you see fit, e.g. adding class variables to init
 
-    def __init__(self):
+    def __init__(self, out=None, pool=None, max_size=MAX_BOARD_SIZE):
         # Define the string to function command mapping
         self.game = None
+        # The game above belongs to session_id; the other sessions wait packed in sessions
+        self.session_id = "default"
+        self.sessions = SessionPool()
+        # Stream every response is written to; None means the current sys.stdout
+        self.out = out
+        self.strategy = "random"
+        self.move_time = DEFAULT_MOVE_TIME
+        # Worker pool for MCTS, started on first use unless a shared one is given
+        self.pool = pool
+        self.owns_pool = pool is None
+        # Transposition table shared by the searches, allocated on first use
+        self.tt = None
+        self.tt_mb = DEFAULT_TT_MB
+        self.max_size = max_size
         self.command_dict = {
             "help" : self.help,
             "game" : self.game_cmd,
@@ -130,23 +1477,52 @@ class CommandInterface:
             "genmove" : self.genmove,
             "winner" : self.winner
         }
+        # Commands beyond the assignment; only listed by 'help all' so that the
+        # plain 'help' output stays as specified
+        self.extra_command_dict = {
+            "undo" : self.undo,
+            "solve" : self.solve,
+            "analyze" : self.analyze,
+            "tt" : self.tt_cmd,
+            "legalmap" : self.legalmap,
+            "playouts" : self.playouts,
+            "strategy" : self.strategy_cmd,
+            "timelimit" : self.timelimit,
+            "perft" : self.perft,
+            "save" : self.save,
+            "load" : self.load,
+            "stats" : self.stats,
+            "session" : self.session
+        }
 
     # Convert a raw string to a command and a list of arguments
     def process_command(self, str):
         str = str.lower().strip()
-        command = str.split(" ")[0]
-        args = [x for x in str.split(" ")[1:] if len(x) > 0]
-        if command not in self.command_dict:
+        words = str.split(" ")
+        command = words[0]
+        args = [x for x in words[1:] if len(x) > 0]
+        if command in self.command_dict:
+            command_function = self.command_dict[command]
+        elif command in self.extra_command_dict:
+            command_function = self.extra_command_dict[command]
+        else:
             print("? Unknown command.\nType 'help' to list known commands.", file=sys.stderr)
-            print("= -1\n")
+            print("= -1\n", file=self.out)
             return False
+        stat = STATS.get(command)
+        if stat is None:
+            stat = STATS[command] = TimingStat()
+        stat.calls += 1
+        start = time.perf_counter()
         try:
-            return self.command_dict[command](args)
+            return command_function(args)
         except Exception as e:
             print("Command '" + str + "' failed with exception:", file=sys.stderr)
             print(e, file=sys.stderr)
-            print("= -1\n")
+            print("= -1\n", file=self.out)
             return False
+        finally:
+            stat.add(time.perf_counter() - start)
         
     # Will continuously receive and execute commands
     # Commands should return True on success, and False on failure
@@ -155,17 +1531,68 @@ class CommandInterface:
         while True:
             str = input()
             if str.split(" ")[0] == "exit":
-                print("= 1\n")
+                self.close()
+                print("= 1\n", file=self.out)
                 return True
             if self.process_command(str):
-                print("= 1\n")
+                print("= 1\n", file=self.out)
+
+    # Same protocol as main_loop, for scripted sessions: stdin is read in bulk, every
+    # complete line received is answered through the buffered stdout, and stdout is
+    # only flushed once no further input is waiting
+    def pipelined_loop(self):
+        if self.out is None:
+            sys.stdout.reconfigure(line_buffering=False)
+        out = self.out if self.out is not None else sys.stdout
+        stdin = sys.stdin.fileno()
+        decoder = codecs.getincrementaldecoder(sys.stdin.encoding or "utf-8")()
+        pending = ""
+        while True:
+            data = os.read(stdin, 1 << 16)
+            pending += decoder.decode(data, final=not data)
+            lines = pending.split("\n")
+            # At end of input the last line may have no newline, as with input()
+            pending = "" if not data else lines.pop()
+            for str in lines:
+                if not data and not str:
+                    continue
+                if str.split(" ")[0] == "exit":
+                    self.close()
+                    print("= 1\n", file=self.out)
+                    out.flush()
+                    return True
+                if self.process_command(str):
+                    print("= 1\n", file=self.out)
+            if not data:
+                out.flush()
+                return True
+            if not select.select([stdin], [], [], 0)[0]:
+                out.flush()
+
+    # Stop the MCTS worker processes, if any were started
+    def close(self):
+        if self.pool is not None and self.owns_pool:
+            self.pool.terminate()
+            self.pool = None
+
+    # Runs one line of the protocol and returns the reply; self.out must be a StringIO
+    def respond(self, str):
+        if self.process_command(str):
+            print("= 1\n", file=self.out)
+        reply = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return reply
 
     # List available commands
     def help(self, args):
         for command in self.command_dict:
             if command != "help":
-                print(command)
-        print("exit")
+                print(command, file=self.out)
+        if args == ["all"]:
+            for command in self.extra_command_dict:
+                print(command, file=self.out)
+        print("exit", file=self.out)
         return True
 
     #======================================================================================
@@ -175,19 +1602,33 @@ class CommandInterface:
     #======================================================================================
 
     def game_cmd(self, args):
-        if len(args) != 2:
-            raise ValueError("'game' command requires 2 arguments: width and height")
-        width, height = map(int, args)
-        if width < 1 or width > 20 or height < 1 or height > 20:
-            raise ValueError("Width and height must be between 1 and 20")
-        self.game = BinaryGame(width, height)
+        if len(args) != 2 and len(args) != 3:
+            raise ValueError("'game' command requires 2 arguments: width and height, and an optional board type")
+        width, height = map(int, args[:2])
+        if width < 1 or width > self.max_size or height < 1 or height > self.max_size:
+            raise ValueError(f"Width and height must be between 1 and {self.max_size}")
+        # Past 20x20 the list board would spend O(W + H) string work per cell checked
+        board_type = args[2] if len(args) == 3 else "list" if width <= MAX_BOARD_SIZE and height <= MAX_BOARD_SIZE else "large"
+        if board_type not in GAME_TYPES:
+            raise ValueError("Board type must be one of: " + ", ".join(GAME_TYPES))
+        self.game = GAME_TYPES[board_type](width, height)
         return True
     
     def show(self, args):
         if self.game is None:
             raise ValueError("No game in progress. Use 'game' command to start a new game.")
-        for row in self.game.board:
-            print(''.join(row))
+        if len(args) == 0:
+            for row in self.game.board:
+                print(''.join(row), file=self.out)
+            return True
+        # 'show x0 y0 width height' prints only that window, clipped to the board
+        if len(args) != 4:
+            raise ValueError("'show' command requires no argument or 4 arguments: x0 y0 width height")
+        x0, y0, width, height = map(int, args)
+        if not 0 <= x0 < self.game.width or not 0 <= y0 < self.game.height or width < 1 or height < 1:
+            raise ValueError("Window must start on the board and have a positive size")
+        for row in self.game.board[y0:y0 + height]:
+            print(''.join(row[x0:x0 + width]), file=self.out)
         return True
     
     def play(self, args):
@@ -197,14 +1638,14 @@ class CommandInterface:
         
         # Check if the play command has exactly 3 arguments
         if len(args) != 3:
-            print(f"= illegal move: " + ' '.join(args) + " wrong number of arguments")
+            print(f"= illegal move: " + ' '.join(args) + " wrong number of arguments", file=self.out)
             return False
 
         # Play the move if valid, otherwise output error message
         x, y, digit = str(args[0]), str(args[1]), str(args[2])
         valid_move, reason = self.game.make_move(x, y, digit)
         if not valid_move:
-            print(f"= illegal move: {x} {y} {digit} " + reason)
+            print(f"= illegal move: {x} {y} {digit} " + reason, file=self.out)
             return False
 
         return True
@@ -213,19 +1654,18 @@ class CommandInterface:
         if self.game is None:
             raise ValueError("No game in progress. Use 'game' command to start a new game.")
         x, y, digit = str(args[0]), str(args[1]), str(args[2])
-        print("yes" if self.game.is_valid_move(x, y, digit)[0] else "no")
+        print("yes" if self.game.is_valid_move(x, y, digit)[0] else "no", file=self.out)
         return True
     
     def genmove(self, args):
         if self.game is None:
             raise ValueError("No game in progress. Use 'game' command to start a new game.")
-        legal_moves = self.game.get_legal_moves()
-        if not legal_moves:
-            print("resign")
+        if self.game.is_game_over():
+            print("resign", file=self.out)
         else:
-            x, y, digit = random.choice(legal_moves)
+            x, y, digit = self.select_move()
             self.game.make_move(str(x), str(y), str(digit))
-            print(f"{x} {y} {digit}")
+            print(f"{x} {y} {digit}", file=self.out)
 
         return True
     
@@ -234,15 +1674,395 @@ class CommandInterface:
             raise ValueError("No game in progress. Use 'game' command to start a new game.")
         winner = self.game.get_winner()
         if winner is None:
-            print("unfinished")
+            print("unfinished", file=self.out)
         else:
-            print(winner)
+            print(winner, file=self.out)
         return True
     
+    def undo(self, args):
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        undone, reason = self.game.undo_move()
+        if not undone:
+            raise ValueError("Cannot undo: " + reason)
+        return True
+
+    def solve(self, args):
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        time_limit = float(args[0]) if len(args) > 0 else self.move_time
+        # nan and inf would give a deadline that never passes
+        if not math.isfinite(time_limit):
+            raise ValueError("Time limit must be a finite number of seconds")
+        node_limit = int(args[1]) if len(args) > 1 else None
+        database = endgame_database(self.game.width, self.game.height)
+        if database is not None:
+            start = time.perf_counter()
+            value, move = database.lookup(self.game)
+            if value is not None:
+                to_move = 1 if self.game.last_player == None else 3 - self.game.last_player
+                if move is None:
+                    print(3 - to_move, file=self.out)
+                else:
+                    print(f"{to_move} {move[0]} {move[1]} {move[2]}", file=self.out)
+                print(f"database {database.path} time {time.perf_counter() - start:.3f}", file=self.out)
+                return True
+        solver = Solver(self.game, time_limit, node_limit, self.get_tt())
+        winner, move = solver.solve()
+        if winner is None:
+            print("unknown", file=self.out)
+        elif move is None:
+            print(winner, file=self.out)
+        else:
+            print(f"{winner} {move[0]} {move[1]} {move[2]}", file=self.out)
+        print(f"nodes {solver.nodes} time {solver.elapsed:.3f} nps {round(solver.nodes_per_second())}", file=self.out)
+        return True
+
+    def analyze(self, args):
+        # Scores every legal move on the worker pool within the time limit, best first
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        game = self.game
+        legal_moves = game.get_legal_moves()
+        start = time.perf_counter()
+        moves = [move[:3] for move in game.move_stack]
+        time_limit = max(self.move_time - MCTS_OVERHEAD, 0.01)
+        pool = self.get_pool()
+        if pool is None:
+            results = analyze_moves(game.board_type, game.width, game.height, moves, legal_moves, time_limit, random.getrandbits(64))
+        else:
+            # Deal the moves out round robin so every worker gets a similar mix
+            workers = min(os.cpu_count(), len(legal_moves))
+            jobs = [(game.board_type, game.width, game.height, moves, legal_moves[worker::workers], time_limit, random.getrandbits(64)) for worker in range(workers)]
+            results = [result for chunk in pool.starmap(analyze_moves, jobs) for result in chunk]
+        # Proven wins, then the Monte Carlo moves by win rate, then proven losses, then unscored moves
+        # Proven results outrank Monte Carlo ones of the same score (1.000 and 0.000)
+        rank = {"win": 0, "mc": 1, "loss": 2, "unknown": 3}
+        results.sort(key=lambda result: (result[2] is None, -(result[2] or 0.0), rank[result[1]], result[0]))
+        for (x, y, digit), result, score, nodes, playouts in results:
+            if score is None:
+                print(f"{x} {y} {digit} {result}", file=self.out)
+                continue
+            line = f"{x} {y} {digit} {result} {score:.3f} nodes {nodes}"
+            print(line + (f" playouts {playouts}" if result == "mc" else ""), file=self.out)
+        print(f"moves {len(results)} time {time.perf_counter() - start:.3f}", file=self.out)
+        return True
+
+    def get_pool(self):
+        # The worker pool, started on first use; None inside a pool worker (a1tournament.py),
+        # where no processes can be started, so the work runs in this process instead
+        if self.pool is None and not multiprocessing.current_process().daemon:
+            self.pool = multiprocessing.Pool(os.cpu_count())
+        return self.pool
+
+    def get_tt(self):
+        if self.tt is None:
+            self.tt = TranspositionTable(self.tt_mb)
+        return self.tt
+
+    def tt_cmd(self, args):
+        # 'tt' prints the table counters, 'tt clear' empties it, 'tt <megabytes>' replaces it
+        if len(args) == 1 and args[0] == "clear":
+            self.get_tt().clear()
+        elif len(args) == 1:
+            size_mb = int(args[0])
+            if size_mb < 1:
+                raise ValueError("Transposition table size must be at least 1 MB")
+            self.tt_mb = size_mb
+            self.tt = TranspositionTable(size_mb)
+        elif len(args) != 0:
+            raise ValueError("'tt' command takes no argument, 'clear' or a size in megabytes")
+        tt = self.get_tt()
+        print(f"size {tt.size_mb}MB slots {tt.capacity()} entries {tt.entries} hits {tt.hits} misses {tt.misses} stores {tt.stores} evictions {tt.evictions}", file=self.out)
+        return True
+
+    def legalmap(self, args):
+        # Prints the legality of every cell as one width x height mask of 1/0 per digit
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        game = self.game
+        if load_numpy() is not None:
+            masks = numpy_legal_masks(board_array(game))
+            rows = [[''.join('1' if legal else '0' for legal in row) for row in mask] for mask in masks.tolist()]
+        else:
+            # Without NumPy the live legal-move flags hold the same answer
+            rows = []
+            for digit in (0, 1):
+                flags = game.legal_flags[digit::2]
+                rows.append([''.join(str(flag) for flag in flags[y * game.width:(y + 1) * game.width]) for y in range(game.height)])
+        for digit in (0, 1):
+            print(f"digit {digit}", file=self.out)
+            for row in rows[digit]:
+                print(row, file=self.out)
+        return True
+
+    def playouts(self, args):
+        # Batched random playouts: win rate per player, then per first move, then throughput
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        if load_numpy() is None:
+            raise ValueError("'playouts' requires NumPy")
+        count = int(args[0]) if len(args) > 0 else 1000
+        seed = int(args[1]) if len(args) > 1 else None
+        if count < 1:
+            raise ValueError("Number of playouts must be positive")
+        start = time.perf_counter()
+        wins, first_moves = batched_playouts(self.game, count, seed)
+        elapsed = time.perf_counter() - start
+        print(f"player 1 {wins[0] / count:.3f}", file=self.out)
+        print(f"player 2 {wins[1] / count:.3f}", file=self.out)
+        for move in sorted(first_moves):
+            played, won = first_moves[move]
+            print(f"{move[0]} {move[1]} {move[2]} playouts {played} winrate {won / played:.3f}", file=self.out)
+        print(f"playouts {count} time {elapsed:.3f} pps {round(count / elapsed) if elapsed > 0 else 0}", file=self.out)
+        return True
+
+    def select_move(self):
+        # Picks the genmove move; the game must not be over
+        if self.strategy == "sample":
+            return self.game.sample_legal_move()
+        legal_moves = self.game.get_legal_moves()
+        if self.strategy != "random" and len(legal_moves) > 1:
+            move = self.database_move(legal_moves)
+            if move is not None:
+                return move
+        if self.strategy == "mcts" and len(legal_moves) > 1:
+            return self.mcts_move()
+        if self.strategy == "search" and len(legal_moves) > 1:
+            return self.search_move()
+        return random.choice(legal_moves)
+
+    def database_move(self, legal_moves):
+        # A winning move from the endgame database, any move if the position is lost there,
+        # None if there is no database entry
+        database = endgame_database(self.game.width, self.game.height)
+        if database is None:
+            return None
+        value, move = database.lookup(self.game)
+        if value == -1:
+            return random.choice(legal_moves)
+        return move
+
+    def search_move(self):
+        # Iterative deepening alpha-beta; depth and time go to stderr to keep the reply a single move
+        solver = Solver(self.game, self.move_time, None, self.get_tt())
+        move, value = solver.iterative_deepening()
+        result = {1: "win", -1: "loss", 0: "unknown"}[value]
+        print(f"depth {solver.depth} {result} nodes {solver.nodes} time {solver.elapsed:.3f}", file=sys.stderr)
+        return move
+
+    def mcts_move(self):
+        # Root parallel MCTS: every worker searches its own tree, then the visit counts are summed
+        game = self.game
+        moves = [move[:3] for move in game.move_stack]
+        time_limit = max(self.move_time - MCTS_OVERHEAD, 0.01)
+        pool = self.get_pool()
+        if pool is None:
+            result = mcts_search(game.board_type, game.width, game.height, moves, time_limit, random.getrandbits(64))
+            return max(result, key=lambda move: result[move][0])
+        jobs = [(game.board_type, game.width, game.height, moves, time_limit, random.getrandbits(64)) for _ in range(os.cpu_count())]
+        visits = {}
+        for result in pool.starmap(mcts_search, jobs):
+            for move, (move_visits, _) in result.items():
+                visits[move] = visits.get(move, 0) + move_visits
+        return max(visits, key=visits.get)
+
+    def strategy_cmd(self, args):
+        # 'strategy' prints the genmove strategy, 'strategy <name>' sets it
+        if len(args) > 0:
+            if args[0] not in STRATEGIES:
+                raise ValueError("Strategy must be one of: " + ", ".join(STRATEGIES))
+            self.strategy = args[0]
+        print(self.strategy, file=self.out)
+        return True
+
+    def timelimit(self, args):
+        # 'timelimit' prints the seconds genmove and solve may use, 'timelimit <seconds>' sets them
+        if len(args) > 0:
+            move_time = float(args[0])
+            if not math.isfinite(move_time) or move_time <= 0:
+                raise ValueError("Time limit must be a positive, finite number of seconds")
+            self.move_time = move_time
+        print(self.move_time, file=self.out)
+        return True
+
+    def perft(self, args):
+        # Counts the move sequences of the given length, then prints time and leaves per second
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        if len(args) != 1 or not args[0].isnumeric():
+            raise ValueError("'perft' command requires 1 argument: depth")
+        start = time.perf_counter()
+        count = perft(self.game, int(args[0]))
+        elapsed = time.perf_counter() - start
+        print(count, file=self.out)
+        print(f"time {elapsed:.3f} nps {round(count / elapsed) if elapsed > 0 else 0}", file=self.out)
+        return True
+
+    def save(self, args):
+        # Appends the current game to a record file
+        if self.game is None:
+            raise ValueError("No game in progress. Use 'game' command to start a new game.")
+        if len(args) != 1:
+            raise ValueError("'save' command requires 1 argument: file name")
+        with open(args[0], "ab") as record_file:
+            write_record(record_file, PackedGame(self.game))
+        return True
+
+    def load(self, args):
+        # Replaces the current game with record number index (default 0) of a record file,
+        # keeping the board type of the current game
+        if len(args) != 1 and len(args) != 2:
+            raise ValueError("'load' command requires a file name and an optional record number")
+        index = int(args[1]) if len(args) == 2 else 0
+        board_type = self.game.board_type if self.game is not None else "list"
+        with open(args[0], "rb") as record_file:
+            for number, packed in enumerate(read_records(record_file, board_type)):
+                if number == index:
+                    self.game = packed.replay(self.max_size)
+                    return True
+        raise ValueError(f"No record {index} in '{args[0]}'")
+
+    def stats(self, args):
+        # One line per command and hot function seen: calls, mean and percentiles in microseconds, histogram
+        if args == ["reset"]:
+            for stat in STATS.values():
+                stat.__init__()
+            return True
+        if len(args) != 0:
+            raise ValueError("'stats' command takes no argument or 'reset'")
+        for name, stat in sorted(STATS.items()):
+            if stat.calls == 0:
+                continue
+            if stat.timed == 0:
+                print(f"{name} calls {stat.calls} timed 0", file=self.out)
+                continue
+            mean = stat.total / stat.timed * 1000000
+            histogram = ' '.join(f"<{2 ** bucket}:{count}" for bucket, count in enumerate(stat.histogram) if count)
+            print(f"{name} calls {stat.calls} timed {stat.timed} mean {mean:.1f}us p50 <{stat.percentile(50)}us p95 <{stat.percentile(95)}us max <{stat.percentile(100)}us hist {histogram}", file=self.out)
+        return True
+
+    def session(self, args):
+        # session                     prints the current session id and the number of sessions
+        # session new|switch <id>     makes a new (empty) or existing session the current one
+        # session drop <id>           deletes a session other than the current one
+        # session idle <seconds|off>  drops sessions unused for that long
+        sessions = self.sessions
+        if len(args) == 0:
+            sessions.evict()
+            print(f"{self.session_id} sessions {len(sessions) + 1} evicted {sessions.evicted}", file=self.out)
+            return True
+        if len(args) != 2:
+            raise ValueError("'session' command requires no argument or 2 arguments")
+        action, session_id = args
+        if action == "idle":
+            sessions.idle_seconds = None if session_id == "off" else float(session_id)
+            sessions.evict()
+        elif action == "new" or action == "switch":
+            if session_id == self.session_id:
+                if action == "new":
+                    raise ValueError("Session '" + session_id + "' already exists")
+                return True
+            if action == "new" and session_id in sessions:
+                raise ValueError("Session '" + session_id + "' already exists")
+            if action == "switch" and session_id not in sessions:
+                raise ValueError("No session '" + session_id + "'")
+            game = None if action == "new" else sessions.take(session_id)
+            sessions.put(self.session_id, self.game)
+            self.session_id = session_id
+            self.game = game
+        elif action == "drop":
+            # There is always a current session; switch away from it to drop it
+            if session_id == self.session_id:
+                raise ValueError("Cannot drop the current session '" + session_id + "', switch to another one first")
+            if session_id not in sessions:
+                raise ValueError("No session '" + session_id + "'")
+            sessions.drop(session_id)
+        else:
+            raise ValueError("'session' action must be new, switch, drop or idle")
+        return True
+
     #======================================================================================
     # End of functions requiring implementation
     #======================================================================================
 
+# Commands that may think for a while; the server runs them in its executor so the
+# other connections keep being served meanwhile
+BLOCKING_COMMANDS = {"genmove", "solve", "perft", "playouts", "analyze"}
+
+# Serves one connection with its own game session until 'exit' or disconnect
+async def serve_session(reader, writer, executor, pool, max_size):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    session = CommandInterface(io.StringIO(), pool, max_size)
+    try:
+        while True:
+            data = await reader.readline()
+            if not data:
+                break
+            line = data.decode(errors="replace").rstrip("\n")
+            # Same normalization as process_command, so CRLF clients can 'exit' too
+            command = line.lower().strip().split(" ")[0]
+            if command == "exit":
+                writer.write(b"= 1\n\n")
+                await writer.drain()
+                break
+            if command in BLOCKING_COMMANDS:
+                reply = await loop.run_in_executor(executor, session.respond, line)
+            else:
+                reply = session.respond(line)
+            writer.write(reply.encode())
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        session.close()
+        writer.close()
+
+async def serve(address, max_size=MAX_BOARD_SIZE):
+    '''
+    Serves the text protocol to any number of clients at once, each connection
+    playing its own game
+
+    :param address: 'tcp:host:port' or 'unix:path'
+    :type address: str
+    :param max_size: largest width and height a client may ask for
+    :type max_size: int
+    '''
+    # Only the server needs these, and they are slow to import
+    import asyncio
+    import concurrent.futures
+    # Start the MCTS workers before any executor thread exists, and share them
+    pool = multiprocessing.Pool(os.cpu_count())
+    executor = concurrent.futures.ThreadPoolExecutor()
+    handler = lambda reader, writer: serve_session(reader, writer, executor, pool, max_size)
+    kind, _, location = address.partition(":")
+    if kind == "tcp":
+        host, _, port = location.rpartition(":")
+        server = await asyncio.start_server(handler, host or None, int(port))
+    elif kind == "unix":
+        server = await asyncio.start_unix_server(handler, location)
+    else:
+        raise ValueError("Server address must be tcp:host:port or unix:path")
+    print("Serving on " + address, file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        pool.terminate()
+
 if __name__ == "__main__":
-    interface = CommandInterface()
-    interface.main_loop()
\ No newline at end of file
+    max_size = LARGE_MAX_BOARD_SIZE if "--large-boards" in sys.argv[1:] else MAX_BOARD_SIZE
+    if "--serve" in sys.argv[1:-1]:
+        import asyncio
+        try:
+            asyncio.run(serve(sys.argv[sys.argv.index("--serve") + 1], max_size))
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+    interface = CommandInterface(max_size=max_size)
+    if "--pipelined" in sys.argv[1:]:
+        interface.pipelined_loop()
+    else:
+        interface.main_loop()
\ No newline at end of file
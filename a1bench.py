@@ -0,0 +1,53 @@
+# CMPUT 455 assignment 1 move generation benchmark
+# Run using: python3 a1bench.py [board type ...]
+# Counts every legal move sequence to a fixed depth from the empty board (perft)
+# for a fixed set of board sizes, and checks the counts against known values.
+
+import sys
+import time
+
+from a1 import GAME_TYPES, perft
+
+# Color codes
+RED = "\033[31m"
+GREEN = "\033[32m"
+RESET = "\033[0m"
+
+# (width, height, depth, expected number of move sequences)
+POSITIONS = [
+    (3, 3, 4, 44928),
+    (4, 4, 4, 660096),
+    (6, 6, 3, 342144),
+    (8, 8, 3, 1998720),
+    (20, 20, 2, 638400)
+]
+
+# Run perft on every position for one board type, returns whether all counts matched
+def bench(board_type):
+    ok = True
+    total_count = 0
+    total_time = 0.0
+    for width, height, depth, expected in POSITIONS:
+        game = GAME_TYPES[board_type](width, height)
+        t0 = time.perf_counter()
+        count = perft(game, depth)
+        elapsed = time.perf_counter() - t0
+        total_count += count
+        total_time += elapsed
+        status = f"{GREEN}ok{RESET}" if count == expected else f"{RED}expected {expected}{RESET}"
+        ok = ok and count == expected
+        print(f"{board_type:<10} {width:>2}x{height:<2} depth {depth}  {count:>9} in {elapsed:7.3f}s  {round(count / elapsed):>9} nps  {status}")
+    print(f"{board_type:<10} total {total_count} in {total_time:.3f}s, {round(total_count / total_time)} nps\n")
+    return ok
+
+if __name__ == "__main__":
+    board_types = sys.argv[1:] if len(sys.argv) > 1 else list(GAME_TYPES)
+    for board_type in board_types:
+        if board_type not in GAME_TYPES:
+            print("Unknown board type '" + board_type + "'. Choose from: " + ", ".join(GAME_TYPES))
+            sys.exit(2)
+
+    ok = True
+    for board_type in board_types:
+        ok = bench(board_type) and ok
+    sys.exit(0 if ok else 1)
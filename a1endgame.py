@@ -0,0 +1,88 @@
+# CMPUT 455 assignment 1 endgame database builder
+# Run using: python3 a1endgame.py [--cells N | WxH ...]
+# Solves every position reachable from the empty board for each size and writes
+# one file per size to the endgame directory (A1_ENDGAME_DIR, default ./endgame),
+# where the engine's 'solve' and 'genmove' look positions up.
+# Without arguments, builds every size with at most 16 cells.
+
+import os
+import sys
+import time
+import tempfile
+
+from a1 import BitboardBinaryGame, ENDGAME_DIR, ENDGAME_MAGIC, ENDGAME_HEADER_BYTES, ENDGAME_MAX_CELLS, ENDGAME_WIN, ENDGAME_LOSS, SHARED_FILE_MODE, endgame_path
+
+# Solve all positions of one size, returns (result of the empty board, bytes of the table, reachable positions)
+def build(width, height):
+    game = BitboardBinaryGame(width, height)
+    powers = [3 ** cell for cell in range(width * height)]
+    # 2 bits per position index, 0 until the position has been solved
+    values = bytearray((3 ** (width * height) + 3) // 4)
+    positions = 0
+
+    # Every child is solved before its parent, the order retrograde analysis uses;
+    # a position is a win for the player to move if some move leads to a loss
+    def solve(index):
+        nonlocal positions
+        positions += 1
+        value = ENDGAME_LOSS
+        for x, y, digit in game.get_legal_moves():
+            child = index + powers[y * width + x] * (digit + 1)
+            child_value = (values[child >> 2] >> ((child & 3) * 2)) & 3
+            if child_value == 0:
+                game.play_move(x, y, digit)
+                child_value = solve(child)
+                game.undo_move()
+            if child_value == ENDGAME_LOSS:
+                value = ENDGAME_WIN
+        values[index >> 2] |= value << ((index & 3) * 2)
+        return value
+
+    result = solve(0)
+    return result, values, positions
+
+# Write the table with its header next to the final path, then move it into place
+def write(width, height, values):
+    os.makedirs(ENDGAME_DIR, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=ENDGAME_DIR)
+    with os.fdopen(descriptor, "wb") as database_file:
+        header = ENDGAME_MAGIC + bytes((1, width, height))
+        database_file.write(header + bytes(ENDGAME_HEADER_BYTES - len(header)))
+        database_file.write(values)
+    os.chmod(temporary, SHARED_FILE_MODE)
+    os.replace(temporary, endgame_path(width, height))
+
+def parse_sizes(args):
+    if len(args) == 0:
+        args = ["--cells", str(ENDGAME_MAX_CELLS)]
+    if args[0] == "--cells":
+        if len(args) != 2 or not args[1].isnumeric():
+            raise ValueError("--cells requires a number of cells")
+        cells = int(args[1])
+        return [(width, height) for width in range(1, cells + 1) for height in range(1, cells // width + 1)]
+    sizes = []
+    for arg in args:
+        width, _, height = arg.partition("x")
+        if not width.isnumeric() or not height.isnumeric():
+            raise ValueError("Board size must be given as WxH, not '" + arg + "'")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+if __name__ == "__main__":
+    try:
+        sizes = parse_sizes(sys.argv[1:])
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    for width, height in sizes:
+        if width < 1 or height < 1 or width * height > ENDGAME_MAX_CELLS:
+            print(f"Board sizes must have between 1 and {ENDGAME_MAX_CELLS} cells, not {width}x{height}")
+            sys.exit(2)
+
+    for width, height in sizes:
+        t0 = time.perf_counter()
+        result, values, positions = build(width, height)
+        write(width, height, values)
+        elapsed = time.perf_counter() - t0
+        winner = 1 if result == ENDGAME_WIN else 2
+        print(f"{width:>2}x{height:<2} winner {winner}  {positions:>8} positions  {len(values):>9} bytes in {elapsed:7.3f}s")
@@ -0,0 +1,231 @@
+# CMPUT 455 assignment 1 differential fuzzer
+# Run using: python3 a1fuzz.py [engine ...] [--commands N] [--seed S] [--max-size N] [-j N]
+# An engine is an engine file with an optional board type, e.g. a1.py:bitboard or test.py.
+# Default engines: a1.py:list a1.py:bitboard a1.py:large.
+# Generates random command scripts (game, play with valid and malformed arguments, legal,
+# genmove, winner, show), runs every script in this process on every engine with the same
+# random seed, and compares the output of each engine with the first one. On the first
+# difference the script is shrunk to a minimal one that still shows it, which is printed
+# with the output of both engines; the exit status is then 1.
+# With -j N, N worker processes fuzz separate streams of scripts at once.
+
+import sys
+import time
+import random
+import importlib.util
+import multiprocessing
+
+# Engine modules already imported, by file name
+modules = {}
+
+# Commands per generated script, before the first 'game'
+SCRIPT_LENGTH = 64
+
+# play commands with bad arguments, filled in with a random cell and digit of the board
+MALFORMED_PLAYS = [
+    "play {width} {y} {digit}",
+    "play {x} {height} {digit}",
+    "play -1 {y} {digit}",
+    "play {x} {y} 2",
+    "play {x} {y} -1",
+    "play {x} {y}",
+    "play {x} {y} {digit} 0",
+    "play a {y} 1",
+    "play {x} b 0",
+    "play {x} {y} x",
+    "play",
+    "play {x}  {y}   {digit}"
+]
+
+class Discard:
+    # Stands in for stderr: engines report failures there, which is not part of the protocol output
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+class Engine:
+    def __init__(self, spec):
+        self.spec = spec
+        file_name, _, self.board_type = spec.partition(":")
+        if file_name not in modules:
+            spec_ = importlib.util.spec_from_file_location("engine" + str(len(modules)), file_name)
+            module = importlib.util.module_from_spec(spec_)
+            spec_.loader.exec_module(module)
+            modules[file_name] = module
+        self.module = modules[file_name]
+
+    # Output of the engine for the script, as one string, or as a list of one string per command if split
+    def run(self, script, seed, split=False):
+        interface = self.module.CommandInterface()
+        random.seed(seed)
+        buffer = OutputBuffer()
+        ends = []
+        board_type = self.board_type
+        stdout = sys.stdout
+        sys.stdout = buffer
+        try:
+            for command in script:
+                if board_type and command.startswith("game ") and len(command.split()) == 3:
+                    command += " " + board_type
+                if interface.process_command(command):
+                    print("= 1\n")
+                ends.append(len(buffer.parts))
+        finally:
+            sys.stdout = stdout
+        if hasattr(interface, "close"):
+            interface.close()
+        if split:
+            return ["".join(buffer.parts[start:end]) for start, end in zip([0] + ends, ends)]
+        return "".join(buffer.parts)
+
+class OutputBuffer:
+    # Cheaper than io.StringIO for many short writes that are read once
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+def generate_script(rng, max_size):
+    # rng.random() scaled to ints, randint would take most of the fuzzing time
+    uniform = rng.random
+    script = []
+    if uniform() < 0.95:
+        width, height = 1 + int(uniform() * max_size), 1 + int(uniform() * max_size)
+        script.append(f"game {width} {height}")
+    else:
+        width, height = 1, 1
+    for _ in range(1 + int(uniform() * SCRIPT_LENGTH)):
+        r = uniform()
+        x, y, digit = int(uniform() * width), int(uniform() * height), int(uniform() * 2)
+        if r < 0.4:
+            script.append(f"play {x} {y} {digit}")
+        elif r < 0.47:
+            script.append(MALFORMED_PLAYS[int(uniform() * len(MALFORMED_PLAYS))].format(x=x, y=y, digit=digit, width=width, height=height))
+        elif r < 0.65:
+            script.append(f"legal {x} {y} {digit}")
+        elif r < 0.85:
+            script.append("genmove")
+        elif r < 0.93:
+            script.append("winner")
+        elif r < 0.98:
+            script.append("show")
+        elif r < 0.99:
+            script.append(f"game {int(uniform() * (max_size + 2))} {int(uniform() * (max_size + 2))}")
+        else:
+            script.append("game 2" if r < 0.995 else "unknown")
+    return script
+
+# Whether the two engines produce different output for the script
+def differs(reference, engine, script, seed):
+    return reference.run(script, seed) != engine.run(script, seed)
+
+def shrink(reference, engine, script, seed):
+    # Delta debugging: drop ever smaller chunks of commands while the difference remains
+    chunk = len(script) // 2
+    while chunk >= 1:
+        start = 0
+        while start < len(script):
+            candidate = script[:start] + script[start + chunk:]
+            if candidate and differs(reference, engine, candidate, seed):
+                script = candidate
+            else:
+                start += chunk
+        chunk //= 2
+    return script
+
+def report(reference, engine, script, seed):
+    print(f"Difference between {reference.spec} and {engine.spec}, commands run after random.seed({seed}):")
+    for command, expected, received in zip(script, reference.run(script, seed, True), engine.run(script, seed, True)):
+        print("  " + command)
+        if expected != received:
+            print(f"    {reference.spec}: " + repr(expected))
+            print(f"    {engine.spec}: " + repr(received))
+
+def parse_args(args):
+    options = {"commands": 1000000, "seed": 0, "max_size": 7, "jobs": 1}
+    flags = {"--commands": "commands", "--seed": "seed", "--max-size": "max_size", "-j": "jobs"}
+    specs = []
+    i = 0
+    while i < len(args):
+        if args[i] in flags:
+            if i + 1 == len(args) or not args[i + 1].lstrip("-").isnumeric():
+                raise ValueError(args[i] + " requires a number")
+            options[flags[args[i]]] = int(args[i + 1])
+            i += 2
+        else:
+            specs.append(args[i])
+            i += 1
+    if not specs:
+        specs = ["a1.py:list", "a1.py:bitboard", "a1.py:large"]
+    if len(specs) < 2:
+        raise ValueError("At least two engines are required")
+    if options["jobs"] < 1:
+        raise ValueError("-j requires at least 1 worker")
+    if not 1 <= options["max_size"] <= 20:
+        raise ValueError("--max-size must be between 1 and 20")
+    return specs, options
+
+# Fuzz with one stream of scripts until the number of commands is reached. Returns
+# (scripts, commands, None) or, on a difference, (scripts, commands, report lines).
+def fuzz(specs, commands_wanted, seed, max_size):
+    engines = [Engine(spec) for spec in specs]
+    rng = random.Random(seed)
+    reference, others = engines[0], engines[1:]
+    stderr = sys.stderr
+    sys.stderr = Discard()
+    scripts = 0
+    commands = 0
+    try:
+        while commands < commands_wanted:
+            script_seed = rng.getrandbits(32)
+            script = generate_script(rng, max_size)
+            expected = reference.run(script, script_seed)
+            for engine in others:
+                if engine.run(script, script_seed) != expected:
+                    script = shrink(reference, engine, script, script_seed)
+                    return scripts, commands, (reference.spec, engine.spec, script, script_seed)
+            scripts += 1
+            commands += len(script)
+    finally:
+        sys.stderr = stderr
+    return scripts, commands, None
+
+def fuzz_args(args):
+    return fuzz(*args)
+
+if __name__ == "__main__":
+    try:
+        specs, options = parse_args(sys.argv[1:])
+        for spec in specs:
+            Engine(spec)
+    except (ValueError, OSError) as e:
+        print(e)
+        print("Usage: python3 a1fuzz.py [engine ...] [--commands N] [--seed S] [--max-size N] [-j N]")
+        sys.exit(2)
+
+    jobs = options["jobs"]
+    t0 = time.perf_counter()
+    if jobs == 1:
+        results = [fuzz(specs, options["commands"], options["seed"], options["max_size"])]
+    else:
+        # Every worker fuzzes its own stream of scripts, seeded from --seed and the worker number
+        work = [(specs, -(-options["commands"] // jobs), options["seed"] * 1000003 + job, options["max_size"]) for job in range(jobs)]
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(fuzz_args, work)
+    elapsed = time.perf_counter() - t0
+
+    scripts = sum(result[0] for result in results)
+    commands = sum(result[1] for result in results)
+    differences = [result[2] for result in results if result[2] is not None]
+    if differences:
+        reference_spec, engine_spec, script, seed = differences[0]
+        report(Engine(reference_spec), Engine(engine_spec), script, seed)
+        sys.exit(1)
+    print(f"{scripts} scripts, {commands} commands on {len(specs)} engines in {elapsed:.3f}s: no differences")
+    print(f"{round(commands / elapsed)} commands/s, {round(commands * len(specs) / elapsed)} engine commands/s")
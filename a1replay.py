@@ -0,0 +1,50 @@
+# CMPUT 455 assignment 1 game record replay
+# Run using: python3 a1replay.py <record file> [list|bitboard]
+# Streams every game of a record file written by the 'save' command (or by any
+# other writer of the same format), replays it move by move through make_move
+# and prints how many games each player won, how many were unfinished or illegal,
+# and the replay speed. Exits non-zero if any record is illegal.
+
+import sys
+import time
+
+from a1 import GAME_TYPES, MAX_BOARD_SIZE, LARGE_MAX_BOARD_SIZE, read_records
+
+def replay(path, board_type):
+    games = 0
+    moves = 0
+    illegal = 0
+    results = {1: 0, 2: 0, None: 0}
+    # The largest size the 'game' command accepts for the board type
+    max_size = LARGE_MAX_BOARD_SIZE if board_type == "large" else MAX_BOARD_SIZE
+    t0 = time.perf_counter()
+    with open(path, "rb") as record_file:
+        for packed in read_records(record_file, board_type):
+            games += 1
+            moves += len(packed.moves)
+            try:
+                game = packed.replay(max_size)
+            except ValueError as e:
+                illegal += 1
+                print(f"record {games - 1}: {e}")
+                continue
+            results[game.get_winner()] += 1
+    elapsed = time.perf_counter() - t0
+    print(f"games {games} moves {moves} player 1 {results[1]} player 2 {results[2]} unfinished {results[None]} illegal {illegal}")
+    print(f"time {elapsed:.3f} games/s {round(games / elapsed) if elapsed > 0 else 0} moves/s {round(moves / elapsed) if elapsed > 0 else 0}")
+    return illegal == 0
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 a1replay.py <record file> [" + "|".join(GAME_TYPES) + "]")
+        sys.exit(2)
+    board_type = sys.argv[2] if len(sys.argv) == 3 else "list"
+    if board_type not in GAME_TYPES:
+        print("Unknown board type '" + board_type + "'. Choose from: " + ", ".join(GAME_TYPES))
+        sys.exit(2)
+    try:
+        ok = replay(sys.argv[1], board_type)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(2)
+    sys.exit(0 if ok else 1)
@@ -1,6 +1,8 @@
 # CMPUT 455 assignment 1 testing script
-# Run using: python3 a1test.py aX.py assignmentX-public-tests.txt [-v]
+# Run using: python3 a1test.py aX.py assignmentX-public-tests.txt [-v] [--inprocess] [-j N]
 # Where X is the current assignment number
+# With --inprocess the engine is imported and run in this process instead of through pipes
+# With -j N the tests are split at each 'game' command and the parts run on N engines at once, one per worker process
 
 import subprocess
 import sys
@@ -8,6 +10,11 @@ import time
 import signal
 import os
 import re
+import io
+import contextlib
+import importlib.util
+import multiprocessing
+import multiprocessing.util
 
 # Default maximum command execution time in seconds
 DEFAULT_TIMEOUT = 1
@@ -35,6 +42,7 @@ class Test:
         self.passed = None
         self.matched = None
         self.notes = ""
+        self.latency = 0.0
 
     # Printed representation of a test
     def __str__(self):
@@ -81,17 +89,12 @@ class Test:
 def file_to_tests(file_name):
     test_lines = []
     with open(file_name, "r") as tf:
-        test_lines = tf.readlines()
-
-    i = 0
-    while i < len(test_lines):
-        # Strip comments
-        test_lines[i] = test_lines[i].split("#")[0].strip()
-        # Delete whitespace lines
-        if len(test_lines[i]) == 0:
-            del test_lines[i]
-        else:
-            i += 1
+        for line in tf:
+            # Strip comments
+            line = line.split("#")[0].strip()
+            # Skip whitespace lines
+            if len(line) > 0:
+                test_lines.append(line)
 
     # Create tests
     tests = []
@@ -136,27 +139,151 @@ def send_command(process, command, expected_fail = False, timeout = DEFAULT_TIME
     except Exception as e:
         return False, "", "Process error:\n" + str(e)
 
+# Runs the engine's CommandInterface in this process, answering commands the way
+# the engine's main loop would over a pipe, with all output captured in memory
+class InProcessEngine:
+    # Engine modules already imported by this process, by file name
+    modules = {}
+
+    def __init__(self, file_name):
+        if file_name not in self.modules:
+            spec = importlib.util.spec_from_file_location("engine", file_name)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.modules[file_name] = module
+        self.interface = self.modules[file_name].CommandInterface()
+        # Lines written by the engine but not read yet, as a pipe would hold them
+        self.lines = []
+        self.errors = io.StringIO()
+
+    # Same results as send_command
+    def send_command(self, command, expected_fail = False, timeout = DEFAULT_TIMEOUT):
+        output = io.StringIO()
+        t0 = time.time()
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(self.errors):
+                if command.split(" ")[0] == "exit":
+                    if hasattr(self.interface, "close"):
+                        self.interface.close()
+                    print("= 1\n")
+                elif self.interface.process_command(command):
+                    print("= 1\n")
+        except Exception as e:
+            return False, "", "Process error:\n" + str(e)
+        self.errors.seek(0)
+        self.errors.truncate()
+        self.lines += output.getvalue().splitlines(True)
+
+        received = ""
+        while self.lines:
+            line = self.lines.pop(0)
+            if line[0] == "=":
+                received += line
+                if time.time() - t0 > timeout:
+                    return False, received, "Command timeout, exceeded maximum allowed time of " + str(timeout) + " seconds."
+                if '= -1' in line and not expected_fail:
+                    return False, received, "Command failed with return code -1."
+                return True, received, ""
+            if len(line.strip()) > 0:
+                received += line
+        return False, received, "Command timeout, exceeded maximum allowed time of " + str(timeout) + " seconds."
+
+    def terminate(self):
+        if hasattr(self.interface, "close"):
+            self.interface.close()
+
 def perform_test(process, test):
-    test.passed, test.received, test.notes = send_command(process, test.command, expected_fail="= -1" in test.expected)
+    t0 = time.time()
+    if isinstance(process, InProcessEngine):
+        test.passed, test.received, test.notes = process.send_command(test.command, expected_fail="= -1" in test.expected)
+    else:
+        test.passed, test.received, test.notes = send_command(process, test.command, expected_fail="= -1" in test.expected)
+    test.latency = time.time() - t0
     if test.expected[0] == '@':
         exp_pattern = re.compile((test.expected.strip())[1:], re.DOTALL)
-        test.matched = exp_pattern.match(test.received.strip())
+        test.matched = exp_pattern.match(test.received.strip()) is not None
     else:
         test.matched = test.expected == test.received
     return test.matched
 
+# Start the engine, either as a child process or inside this one
+def start_engine(file_name, inprocess=False):
+    if inprocess:
+        return InProcessEngine(file_name)
+    return subprocess.Popen(["python3", file_name], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+# Split tests into independent shards, each starting at a 'game' command
+def split_shards(tests):
+    shards = [[]]
+    for test in tests:
+        if test.command.split(" ")[0].lower() == "game" and len(shards[-1]) > 0:
+            shards.append([])
+        shards[-1].append(test)
+    return shards
+
+# Engine of this pool worker, started once by start_worker and reused for every shard
+worker_engine = None
+worker_error = None
+
+# Pool initializer: start the worker's engine, stopped again when the worker exits
+def start_worker(file_name, inprocess):
+    global worker_engine, worker_error
+    try:
+        worker_engine = start_engine(file_name, inprocess)
+    except Exception as e:
+        worker_error = "Failed to start " + file_name + ":\n" + str(e)
+        return
+    if not inprocess:
+        multiprocessing.util.Finalize(worker_engine, worker_engine.terminate, exitpriority=10)
+
+# Run one shard on the worker's engine; every shard starts with 'game', which resets the board
+def run_shard(tests):
+    if worker_engine is None:
+        for test in tests:
+            test.passed, test.received, test.notes, test.matched = False, "", worker_error, False
+        return tests
+    for test in tests:
+        perform_test(worker_engine, test)
+    return tests
+
+# Nearest-rank percentile of a sorted list
+def percentile(values, p):
+    return values[min(len(values) - 1, max(0, -(-p * len(values) // 100) - 1))]
+
 # Test a given process on a number of tests. Prints and returns results.
 def test_process(process, tests, verbose=False, print_output=False):
     t0 = time.time()
-    successful = []
-    failed = []
-    mismatched = []
     test_num = 1
     for test in tests:
         if print_output:
             print("Test", test_num, "/", len(tests), "(" + str(round(100 * test_num / len(tests))) + "%)", end="\r")
         test_num += 1
         perform_test(process, test)
+
+    return report(tests, t0, verbose, print_output)
+
+# Test shards of the tests on a pool of engines at once. Prints and returns results like test_process.
+def test_parallel(file_name, tests, jobs, inprocess=False, verbose=False, print_output=False):
+    t0 = time.time()
+    shards = split_shards(tests)
+    results = []
+    pool = multiprocessing.Pool(jobs, start_worker, (file_name, inprocess))
+    for shard in pool.imap(run_shard, shards):
+        results.append(shard)
+        if print_output:
+            print("Shard", len(results), "/", len(shards), "(" + str(round(100 * len(results) / len(shards))) + "%)", end="\r")
+    # Let the workers exit normally, so that they stop their engines
+    pool.close()
+    pool.join()
+    # Shards come back in order, so the tests keep their numbering
+    tests[:] = [test for shard in results for test in shard]
+    return report(tests, t0, verbose, print_output)
+
+def report(tests, t0, verbose, print_output):
+    successful = []
+    failed = []
+    mismatched = []
+    for test in tests:
         if not test.passed:
             failed.append(test)
         elif not test.matched:
@@ -176,7 +303,15 @@ def test_process(process, tests, verbose=False, print_output=False):
         print(f"{BLUE}\tSuccessful commands with mismatched outputs: (" + str(len(mismatched)) + f"):\n{RESET}")
         for test in mismatched:
             print(test)
-        print(f"{BLUE}\tSummary report:\n{RESET}")
+        print(f"{BLUE}\tCommand latency in seconds:\n{RESET}")
+        latencies = {}
+        for test in tests:
+            latencies.setdefault(test.command.split(" ")[0].lower(), []).append(test.latency)
+        print("command".ljust(12), "count".rjust(7), "p50".rjust(8), "p95".rjust(8), "max".rjust(8))
+        for command in latencies:
+            values = sorted(latencies[command])
+            print(command.ljust(12), str(len(values)).rjust(7), *[f"{value:.4f}".rjust(8) for value in (percentile(values, 50), percentile(values, 95), values[-1])])
+        print(f"\n{BLUE}\tSummary report:\n{RESET}")
         print(len(tests), "Tests performed")
         print(f"{GREEN}" + str(len(successful)) + " Successful (" + str(round(100*len(successful) / len(tests))) + f"%){RESET}")
         print(f"{RED}" + str(len(failed)) + " Failed (" + str(round(100*len(failed) / len(tests))) + f"%){RESET}")
@@ -186,28 +321,41 @@ def test_process(process, tests, verbose=False, print_output=False):
     return successful, failed, mismatched
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3 and (len(sys.argv) != 4 or sys.argv[3] != "-v"):
-        print("Usage:\npython3 a1test.py aX.py assignmentX-public-tests.txt [-v]")
+    args = sys.argv[1:]
+    jobs = 1
+    if "-j" in args:
+        i = args.index("-j")
+        jobs = int(args[i + 1]) if i + 1 < len(args) and args[i + 1].isnumeric() and int(args[i + 1]) > 0 else 0
+        del args[i:i + 2]
+    files = [arg for arg in args if not arg.startswith("-")]
+    options = [arg for arg in args if arg.startswith("-")]
+    if jobs < 1 or len(files) != 2 or any(option not in ["-v", "--inprocess"] for option in options):
+        print("Usage:\npython3 a1test.py aX.py assignmentX-public-tests.txt [-v] [--inprocess] [-j N]")
         sys.exit()
 
-    verbose = len(sys.argv) == 4 and sys.argv[3] == "-v"
+    verbose = "-v" in options
+    inprocess = "--inprocess" in options
 
-    if not os.path.isfile(sys.argv[1]):
-        print("File '" + sys.argv[1] + "' not found.")
+    if not os.path.isfile(files[0]):
+        print("File '" + files[0] + "' not found.")
         sys.exit()
-    if not os.path.isfile(sys.argv[2]):
-        print("File '" + sys.argv[2] + "' not found.")
+    if not os.path.isfile(files[1]):
+        print("File '" + files[1] + "' not found.")
+        sys.exit()
+
+    tests = file_to_tests(files[1])
+
+    if jobs > 1:
+        test_parallel(files[0], tests, jobs, inprocess, verbose, True)
         sys.exit()
 
     try:
-        proc = subprocess.Popen(["python3", sys.argv[1]], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        proc = start_engine(files[0], inprocess)
     except Exception as e:
-        print("Failed to start " + sys.argv[1])
+        print("Failed to start " + files[0])
         print("Error:")
         print(e)
         sys.exit()
-    
-    tests = file_to_tests(sys.argv[2])
 
     test_process(proc, tests, verbose, True)
     proc.terminate()
@@ -0,0 +1,192 @@
+# CMPUT 455 assignment 1 self-play tournament
+# Run using: python3 a1tournament.py <engine A> <engine B> [--games N] [--sizes WxH,...] [--board list|bitboard]
+#                                    [-j N] [--seed S] [--out results.csv|results.jsonl] [--records games.a1g]
+# An engine is a genmove strategy with an optional time limit in seconds, e.g. random, search:0.2 or mcts:0.5.
+# Plays N games (default 1000) between the two engines, cycling through the board sizes
+# (default 4x4,6x6) and alternating who moves first, on a pool of N worker processes
+# (default one per CPU). Every finished game is written to the --out file straight away
+# (CSV, or JSON lines if the name ends in .jsonl) and optionally to a game record file.
+# At the end prints games/second, engine A's win rate with a 95% confidence interval
+# overall and per size, and the average time per move of each engine.
+
+import sys
+import os
+import io
+import time
+import json
+import math
+import random
+import multiprocessing
+
+from a1 import CommandInterface, GAME_TYPES, STRATEGIES, DEFAULT_MOVE_TIME, PackedGame, write_record
+
+# Columns of the results file, one row per game
+FIELDS = ["game", "width", "height", "first", "second", "winner", "moves", "seconds", "a_move_time", "b_move_time"]
+
+# 1.96 standard deviations either side: a 95% interval
+Z = 1.96
+
+# Engines of this worker process by name, kept between games so their transposition tables are reused
+players = {}
+
+def parse_engine(name):
+    strategy, _, move_time = name.partition(":")
+    if strategy not in STRATEGIES:
+        raise ValueError("Engine strategy must be one of: " + ", ".join(STRATEGIES) + ", not '" + strategy + "'")
+    return strategy, float(move_time) if move_time else DEFAULT_MOVE_TIME
+
+# Pool initializer: the search engine reports every move on stderr, which would flood the console
+def quiet():
+    sys.stderr = open(os.devnull, "w")
+
+def get_player(name):
+    if name not in players:
+        player = CommandInterface(io.StringIO())
+        player.strategy, player.move_time = parse_engine(name)
+        players[name] = player
+    return players[name]
+
+# Play one game, engines[0] moving first. Returns the result row, the seconds and moves of
+# the first and second player, and the packed game.
+def play_game(number, width, height, board_type, engines, seed):
+    random.seed(seed)
+    game = GAME_TYPES[board_type](width, height)
+    sides = [get_player(engine) for engine in engines]
+    for side in sides:
+        side.game = game
+    move_times = [0.0, 0.0]
+    move_counts = [0, 0]
+    t0 = time.perf_counter()
+    while not game.is_game_over():
+        turn = len(game.move_stack) % 2
+        t1 = time.perf_counter()
+        x, y, digit = sides[turn].select_move()
+        move_times[turn] += time.perf_counter() - t1
+        move_counts[turn] += 1
+        game.play_move(x, y, digit)
+    elapsed = time.perf_counter() - t0
+    row = {
+        "game": number,
+        "width": width,
+        "height": height,
+        "first": engines[0],
+        "second": engines[1],
+        "winner": engines[game.get_winner() - 1],
+        "moves": len(game.move_stack),
+        "seconds": round(elapsed, 6)
+    }
+    return row, move_times, move_counts, PackedGame(game)
+
+def play_game_args(args):
+    return play_game(*args)
+
+# Wilson score interval for wins out of games
+def wilson(wins, games):
+    if games == 0:
+        return (0.0, 1.0)
+    p = wins / games
+    center = (p + Z * Z / (2 * games)) / (1 + Z * Z / games)
+    spread = Z * math.sqrt(p * (1 - p) / games + Z * Z / (4 * games * games)) / (1 + Z * Z / games)
+    return (max(0.0, center - spread), min(1.0, center + spread))
+
+def parse_args(args):
+    options = {"games": 1000, "sizes": "4x4,6x6", "board": "list", "jobs": os.cpu_count(), "seed": 0, "out": None, "records": None}
+    flags = {"--games": "games", "--sizes": "sizes", "--board": "board", "-j": "jobs", "--seed": "seed", "--out": "out", "--records": "records"}
+    engines = []
+    i = 0
+    while i < len(args):
+        if args[i] in flags:
+            if i + 1 == len(args):
+                raise ValueError(args[i] + " requires a value")
+            options[flags[args[i]]] = args[i + 1]
+            i += 2
+        else:
+            engines.append(args[i])
+            i += 1
+    if len(engines) != 2:
+        raise ValueError("Two engines are required")
+    for engine in engines:
+        parse_engine(engine)
+    if options["board"] not in GAME_TYPES:
+        raise ValueError("Board type must be one of: " + ", ".join(GAME_TYPES))
+    sizes = []
+    for size in options["sizes"].split(","):
+        width, _, height = size.partition("x")
+        if not width.isnumeric() or not height.isnumeric() or not 1 <= int(width) <= 20 or not 1 <= int(height) <= 20:
+            raise ValueError("Board sizes must be given as WxH with both between 1 and 20, not '" + size + "'")
+        sizes.append((int(width), int(height)))
+    options["sizes"] = sizes
+    options["games"] = int(options["games"])
+    options["jobs"] = int(options["jobs"])
+    options["seed"] = int(options["seed"])
+    return engines, options
+
+def run(engines, options):
+    a, b = engines
+    jobs = []
+    for number in range(options["games"]):
+        width, height = options["sizes"][number % len(options["sizes"])]
+        # Each size gets as many games with A first as with B first
+        order = (a, b) if number // len(options["sizes"]) % 2 == 0 else (b, a)
+        jobs.append((number, width, height, options["board"], order, options["seed"] * 1000003 + number))
+
+    out_file = open(options["out"], "w", newline="") if options["out"] else None
+    jsonl = options["out"] is not None and options["out"].endswith(".jsonl")
+    if out_file is not None and not jsonl:
+        out_file.write(",".join(FIELDS) + "\n")
+    records_file = open(options["records"], "ab") if options["records"] else None
+
+    # Per size: [games, wins of A]; per engine: [seconds, moves]
+    results = {size: [0, 0] for size in options["sizes"]}
+    move_times = {"a": [0.0, 0], "b": [0.0, 0]}
+    t0 = time.perf_counter()
+    try:
+        with multiprocessing.Pool(options["jobs"], quiet) as pool:
+            for row, seconds, moves, packed in pool.imap_unordered(play_game_args, jobs):
+                # The first player wins when the number of moves is odd
+                a_turn = row["game"] // len(options["sizes"]) % 2
+                for turn, engine in ((a_turn, "a"), (1 - a_turn, "b")):
+                    move_times[engine][0] += seconds[turn]
+                    move_times[engine][1] += moves[turn]
+                    row[engine + "_move_time"] = round(seconds[turn] / moves[turn], 6) if moves[turn] else 0.0
+                size = results[(row["width"], row["height"])]
+                size[0] += 1
+                size[1] += (row["moves"] % 2 == 1) == (a_turn == 0)
+                if out_file is not None:
+                    if jsonl:
+                        out_file.write(json.dumps(row) + "\n")
+                    else:
+                        out_file.write(",".join(str(row[field]) for field in FIELDS) + "\n")
+                    out_file.flush()
+                if records_file is not None:
+                    write_record(records_file, packed)
+                done = sum(size[0] for size in results.values())
+                print("Game", done, "/", len(jobs), "(" + str(round(100 * done / len(jobs))) + "%)", end="\r")
+    finally:
+        if out_file is not None:
+            out_file.close()
+        if records_file is not None:
+            records_file.close()
+    elapsed = time.perf_counter() - t0
+
+    games = sum(size[0] for size in results.values())
+    wins = sum(size[1] for size in results.values())
+    print(f"{a} vs {b}: {games} games in {elapsed:.3f}s, {games / elapsed:.1f} games/s")
+    low, high = wilson(wins, games)
+    print(f"all     {a} wins {wins}/{games} = {wins / games:.3f} [{low:.3f}, {high:.3f}]")
+    for (width, height), (size_games, size_wins) in results.items():
+        low, high = wilson(size_wins, size_games)
+        rate = size_wins / size_games if size_games else 0.0
+        print(f"{width:>2}x{height:<2}   {a} wins {size_wins}/{size_games} = {rate:.3f} [{low:.3f}, {high:.3f}]")
+    for engine, name in (("a", a), ("b", b)):
+        seconds, moves = move_times[engine]
+        print(f"{name} {moves} moves, {1000 * seconds / moves if moves else 0.0:.3f}ms per move")
+
+if __name__ == "__main__":
+    try:
+        engines, options = parse_args(sys.argv[1:])
+    except ValueError as e:
+        print(e)
+        print("Usage: python3 a1tournament.py <engine A> <engine B> [--games N] [--sizes WxH,...] [--board list|bitboard] [-j N] [--seed S] [--out file] [--records file]")
+        sys.exit(2)
+    run(engines, options)